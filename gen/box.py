@@ -0,0 +1,140 @@
+import numpy as num
+from typing import *
+
+"""
+Box geometry for the scene: boxes spanning [x, x+dx] x [y, y+dy] x [0, height] (Z-up, x/y =
+kinds grid indices). Shared by the Blender build (obj.py), the native glTF writer (glb.py)
+and the mesh tracer (sim/backend.py).
+
+Runs of chunks w/ the same kind and height are greedily merged into maximal rectangles,
+so long shelf rows and walls become a handful of boxes instead of one per chunk.
+Only the visible faces of those boxes are emitted: their tops, and the parts of their sides
+not against a neighbor at least as tall, merged along each grid line. Bottoms lie on the
+floor and are dropped.
+
+boxes(kinds, heights) -> origins, sizes, codes
+faces(kinds, heights) -> corners, normals, codes (-> quads or triangles)
+"""
+
+KINDS = {
+    0: "empty",
+    1: "shelf",
+    2: "pile",
+    3: "wall",
+}
+
+COL = {
+    "shelf": (0.8039, 0.5216, 0.24706, 1),
+    "pile": (0.62745, 0.32157, 0.17647, 1),
+    "wall": (0.6, 0.6, 0.6, 1)
+}
+
+# Unit box: corners and outward-facing quads
+CORNERS = num.array([
+    [0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+    [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]
+])
+QUADS = num.array([
+    [0, 3, 2, 1], [4, 5, 6, 7], # bottom, top
+    [0, 1, 5, 4], [1, 2, 6, 5], [2, 3, 7, 6], [3, 0, 4, 7] # sides
+])
+NORMALS = num.array([
+    [0, 0, -1], [0, 0, 1],
+    [0, -1, 0], [1, 0, 0], [0, 1, 0], [-1, 0, 0]
+])
+
+def yUp(v):
+    """Z-up (Blender, grids) to Y-up (glTF, tracer): (x, y, z) -> (x, z, -y)"""
+    return num.stack([v[:, 0], v[:, 2], -v[:, 1]], axis=1)
+
+def _merge(kinds, heights) -> List[Tuple[int, int, int, int]]:
+    """Greedy meshing: grow each unclaimed chunk along y, then along x while rows match"""
+    key = (kinds*(heights.max() + 1) + heights) * (kinds > 0)
+    rows = key.tolist(); n, m = key.shape
+    done = [[False]*m for _ in range(n)]
+    rects = []
+    for x in range(n):
+        row, seen = rows[x], done[x]; y = 0
+        while y < m:
+            k = row[y]
+            if not k or seen[y]: y += 1; continue
+            y1 = y + 1
+            while y1 < m and row[y1] == k and not seen[y1]: y1 += 1
+            run = [k]*(y1 - y); x1 = x + 1
+            while x1 < n and rows[x1][y:y1] == run and not any(done[x1][y:y1]): x1 += 1
+            for i in range(x, x1): done[i][y:y1] = [True]*(y1 - y)
+            rects.append((x, y, x1 - x, y1 - y))
+            y = y1
+    return rects
+
+def boxes(kinds, heights, merge=True) -> Tuple[num.ndarray, num.ndarray, num.ndarray]:
+    if merge:
+        rects = num.array(_merge(kinds, heights), dtype=int).reshape(-1, 4)
+        xs, ys, dx, dy = rects.T
+        origins = num.stack([xs, ys, num.zeros(len(xs), dtype=int)], axis=1)
+        return origins, num.stack([dx, dy, heights[xs, ys]], axis=1), kinds[xs, ys]
+
+    xs, ys = num.nonzero(kinds)
+    n = len(xs)
+    origins = num.stack([xs, ys, num.zeros(n, dtype=int)], axis=1)
+    sizes = num.stack([num.ones(n, dtype=int), num.ones(n, dtype=int), heights[xs, ys]], axis=1)
+    return origins, sizes, kinds[xs, ys]
+
+def _runs(key) -> Tuple[num.ndarray, num.ndarray, num.ndarray]:
+    """Runs of equal nonzero keys along each row: row, start, stop"""
+    pad = num.zeros((len(key), 1), key.dtype)
+    rows, cols = num.nonzero(num.diff(num.concatenate([pad, key, pad], axis=1), axis=1))
+    same = rows[:-1] == rows[1:]
+    rows, start, stop = rows[:-1][same], cols[:-1][same], cols[1:][same]
+    keep = key[rows, start] > 0
+    return rows[keep], start[keep], stop[keep]
+
+def _sides(kinds, heights, top):
+    """Visible side runs facing +x, then -x: quad (see QUADS), x, y0, y1, low, high, kind"""
+    for shift, quad in [(1, 3), (-1, 5)]:
+        near = num.roll(heights, -shift, axis=0)
+        near[-1 if shift > 0 else 0] = 0  # outside the grid
+        key = (kinds*top + near)*top + heights
+        key[(kinds == 0) | (heights <= near)] = 0
+        x, y0, y1 = _runs(key)
+        k = key[x, y0]
+        yield quad, x, y0, y1, k // top % top, k % top, k // top**2
+
+def faces(kinds, heights) -> Tuple[num.ndarray, num.ndarray, num.ndarray]:
+    """Visible quads of the merged boxes: corners (n, 4, 3, outward CCW), normals, codes"""
+    kinds, heights = num.asarray(kinds, dtype=int), num.asarray(heights, dtype=int)
+    origins, sizes, codes = boxes(kinds, heights)
+    up = sizes[:, 2] > 0
+    origins, sizes, codes = origins[up], sizes[up], codes[up]
+    parts = [(num.ones(len(origins), dtype=int), origins, sizes, codes)]  # tops
+
+    top = int(heights.max()) + 1
+    for axes, (kindsT, heightsT) in [((0, 1), (kinds, heights)), ((1, 0), (kinds.T, heights.T))]:
+        for quad, x, y0, y1, low, high, code in _sides(kindsT, heightsT, top):
+            o, s = num.zeros((len(x), 3), dtype=int), num.ones((len(x), 3), dtype=int)
+            o[:, axes[0]], o[:, axes[1]], o[:, 2] = x, y0, low
+            s[:, axes[1]], s[:, 2] = y1 - y0, high - low
+            if axes[0]: quad = {3: 4, 5: 2}[quad]  # transposed: +x/-x faces are +y/-y
+            parts.append((num.full(len(x), quad), o, s, code))
+
+    quad, origins, sizes, codes = (num.concatenate(p) for p in zip(*parts))
+    corners = origins[:, None] + CORNERS[QUADS[quad]]*sizes[:, None]
+    return corners, NORMALS[quad], codes
+
+def quads(corners) -> Tuple[num.ndarray, num.ndarray]:
+    """Shared-corner mesh of faces: unique vertices and a quad per face"""
+    verts, faces = num.unique(corners.reshape(-1, 3), axis=0, return_inverse=True)
+    return verts, faces.reshape(-1, 4)
+
+def triangles(corners, normals) -> Tuple[num.ndarray, num.ndarray, num.ndarray]:
+    """Flat-shaded mesh of faces: 4 vertices (w/ normals) per face, 2 triangles per face"""
+    verts = corners.reshape(-1, 3)
+    normals = num.repeat(normals, 4, axis=0)
+    quad = 4*num.arange(len(corners))[:, None]
+    tris = (quad + num.array([[0, 1, 2], [0, 2, 3]]).reshape(1, 6)).reshape(-1, 3)
+    return verts, normals, tris
+
+def stats(kinds, corners) -> str:
+    """Before (a closed box per chunk) and after merging and culling"""
+    cells, n = int(num.count_nonzero(kinds)), len(corners)
+    return f"{cells} chunks -> {n} faces, {cells*12} -> {n*2} triangles"
@@ -0,0 +1,72 @@
+import json
+import struct
+import numpy as num
+from .box import faces, triangles, stats, yUp, COL, KINDS
+
+"""
+Writes the scene as glTF binary (GLB) directly from the kinds and heights grids, without
+Blender. Matches the Blender export: one "Obstacles" mesh w/ a primitive per material,
+and Blender's Z-up axes converted to glTF's Y-up, (x, y, z) -> (x, z, -y).
+
+write(kinds, heights, "vis/assets/scene.glb") -> merging stats
+
+See main.py for usage
+"""
+
+class _Buffer:
+    def __init__(self):
+        self.data = bytearray(); self.views = []; self.accessors = []
+
+    def add(self, array, kind, target, bounds=False) -> int:
+        comp = {num.float32: 5126, num.uint32: 5125}[array.dtype.type]
+        self.views.append({"buffer": 0, "byteOffset": len(self.data),
+            "byteLength": array.nbytes, "target": target})
+        self.data += array.tobytes()
+        self.data += bytes(-len(self.data) % 4)  # 4-byte alignment
+        accessor = {"bufferView": len(self.views) - 1, "componentType": comp,
+            "count": len(array), "type": kind}
+        if bounds: accessor |= {"min": array.min(axis=0).tolist(),
+            "max": array.max(axis=0).tolist()}
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+def write(kinds, heights, out) -> str:
+    """Returns before/after merging stats"""
+    corners, normals, codes = faces(kinds, heights)
+    buf, primitives, materials = _Buffer(), [], []
+
+    for kind, color in COL.items():
+        code = next(k for k, v in KINDS.items() if v == kind)
+        picked = codes == code
+        if not picked.any(): continue
+        verts, norms, tris = triangles(corners[picked], normals[picked])
+        primitives.append({
+            "attributes": {
+                "POSITION": buf.add(yUp(verts).astype(num.float32), "VEC3", 34962, True),
+                "NORMAL": buf.add(yUp(norms).astype(num.float32), "VEC3", 34962),
+            },
+            "indices": buf.add(tris.astype(num.uint32).ravel(), "SCALAR", 34963),
+            "material": len(materials),
+        })
+        materials.append({"name": kind, "pbrMetallicRoughness": {
+            "baseColorFactor": list(color), "metallicFactor": 0, "roughnessFactor": 0.5}})
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "edge-mesh-simulator"},
+        "scene": 0, "scenes": [{"nodes": [0]}],
+        "nodes": [{"name": "Obstacles", "mesh": 0}],
+        "meshes": [{"name": "Obstacles", "primitives": primitives}],
+        "materials": materials,
+        "buffers": [{"byteLength": len(buf.data)}],
+        "bufferViews": buf.views, "accessors": buf.accessors,
+    }
+
+    head = json.dumps(gltf, separators=(",", ":")).encode()
+    head += b" " * (-len(head) % 4)
+    chunks = struct.pack("<II", len(head), 0x4E4F534A) + head  # JSON
+    chunks += struct.pack("<II", len(buf.data), 0x004E4942) + bytes(buf.data)
+
+    with open(out, "wb") as file:
+        file.write(struct.pack("<III", 0x46546C67, 2, 12 + len(chunks)))  # glTF v2
+        file.write(chunks)
+    return stats(kinds, corners)
@@ -1,73 +1,71 @@
 import bpy as b
-from sys import argv as args
+import bmesh
+from sys import argv as args, path as paths
+from os import path
 import numpy as num
 from time import time
 from sys import stdout
 
+paths.append(path.dirname(path.abspath(__file__)))
+from box import KINDS, COL, faces, quads, stats # noqa: E402
+
 """
-Uses heights and kinds grids to build each chunk by stretching cubes.
+Uses heights and kinds grids to build merged boxes of chunks, all in a single mesh.
+
+The boxes' visible faces are generated with numpy (box.py) and loaded in one pass (from_pydata),
+with per-face material indices set through foreach_set; no per-cube operators or joins.
 
-!! requires path to scene data (.npz) and output directory as arguments.
-exports to <out>/scene.glb (glTF binary)
+!! requires path to scene data (directory of kinds.npy, heights.npy; memory-mapped) and
+output directory as arguments.
+exports to <out>/scene.glb (glTF binary); prints progress (0-1) and "stats: <before -> after>"
 
 See main.py for usage
 """
 
+def progress(p):
+    print(f"{p:.2f}")
+    stdout.flush()
+
 b.ops.object.select_all(action="SELECT")
 b.ops.object.delete()
-obstacles = b.data.objects.new("Obstacles", b.data.meshes.new("Obstacles") )
+mesh = b.data.meshes.new("Obstacles")
+obstacles = b.data.objects.new("Obstacles", mesh)
 b.context.collection.objects.link(obstacles)
 
-KINDS = {
-    0: "empty",
-    1: "shelf",
-    2: "pile",
-    3: "wall",
-}
-
-COL = {
-    "shelf": (0.8039, 0.5216, 0.24706, 1),
-    "pile": (0.62745, 0.32157, 0.17647, 1),
-    "wall": (0.6, 0.6, 0.6, 1)
-}
-
 # Make materials as per color dict
 mats = {c: b.data.materials.new(name=c) for c in COL}
 for c, m in mats.items(): m.diffuse_color = COL[c]
+for m in mats.values(): mesh.materials.append(m)
+slot = {code: list(COL).index(kind) for code, kind in KINDS.items() if kind in COL}
 
 i = args.index("--") + 1
 data, out = args[i:i+2]
-grid = num.load(data)
-cols, rows = grid["k"].shape
+kinds, heights = (num.load(path.join(data, f"{g}.npy"), mmap_mode="r")
+    for g in ("kinds", "heights"))
 
 start = time()
-for x in range(rows):
-    print(f"{x/rows:.2f}")
-    stdout.flush()
+progress(0)
 
-    for y in range(cols):
-        if KINDS[grid["k"][y, x]] == "empty": continue
-        b.ops.mesh.primitive_cube_add(size=1, location=(y+0.5, x+0.5, 0))
-        height = grid["h"][y, x]
-        cube = b.context.active_object
-        if cube: # scale to height, apply mat:
-            cube.scale[2] = height
-            cube.location[2] += height / 2
-            cube.data.materials.append(mats[KINDS[grid["k"][y, x]]]) # type: ignore
-            cube.select_set(True)
+corners, _, codes = faces(kinds, heights) # see box.py
+verts, polys = quads(corners)
+materials = num.array([slot[k] for k in codes.tolist()])
+print(f"stats: {stats(kinds, corners)}")
+progress(0.25)
 
-        # Combine into one mesh
-        obstacles.select_set(True)
-        b.context.view_layer.objects.active = obstacles
-        b.ops.object.join()
-        obstacles.select_set(False)
+mesh.from_pydata(verts.tolist(), [], polys.tolist())
+mesh.polygons.foreach_set("material_index", materials.astype(num.int32))
+progress(0.5)
 
-# Mesh cleanup (deduplicate vertices)
-b.ops.object.editmode_toggle()
-b.ops.mesh.select_all(action="SELECT")
-b.ops.mesh.dissolve_limited()
-b.ops.mesh.remove_doubles()
-b.ops.object.editmode_toggle()
+# Mesh cleanup (deduplicate vertices), once over the whole mesh
+bm = bmesh.new()
+bm.from_mesh(mesh)
+bmesh.ops.remove_doubles(bm, verts=bm.verts[:], dist=0.0001)
+bmesh.ops.dissolve_limit(bm, angle_limit=0.0872665,
+    verts=bm.verts[:], edges=bm.edges[:], delimit={"NORMAL"})
+bm.to_mesh(mesh)
+bm.free()
+mesh.update()
+progress(0.75)
 
 b.context.view_layer.update()
 
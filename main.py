@@ -1,26 +1,35 @@
 from gen.proc import *
 from gen.place import *
 from sim.signal import *
-from sim import rep
+from sim import rep, cache, metrics, backend as backends
+from gen import glb
 from typing import *  # type: ignore
 from attrs import define, Factory as new
 import matplotlib.pyplot as plot
 from subprocess import Popen, PIPE, DEVNULL
-from numpy import savez_compressed as export
-from tempfile import NamedTemporaryFile
+from tempfile import TemporaryDirectory
 from os import getcwd as cwd, path, mkdir
-from contextlib import suppress, asynccontextmanager
-from fastapi import FastAPI
+from contextlib import suppress, asynccontextmanager, contextmanager
+from fastapi import FastAPI, HTTPException, Query, Header, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse
 from time import time
+from collections import OrderedDict
 from rich import print
 from rich.progress import Progress
 from sys import stderr
-import threading
+from uuid import uuid4
+import numpy as num
+import asyncio
+import random
 import uvicorn
 import toml
+import json
+try: import msgpack
+except ImportError: msgpack = None # only needed for ?format=msgpack
 
 config = toml.load("config.toml")
+TICK = config.get("tick", 10)  # /ws updates per second
 
 @define
 class Timer:
@@ -29,77 +38,128 @@ class Timer:
     def __str__(self):
         return f"{time() - self._start:.2f}s"
 
-proc, progress = None, 0.0
+proc = None
+STAGES = ["layout", "features", "nodes", "cloud", "links", "geometry"]
+stages = dict.fromkeys(STAGES, 0.0)  # build progress per stage, [0, 1]
+error: str | None = None  # why the build stopped, if it failed
 
-def blender(tmp, out):
-    global proc, progress
-    proc = Popen(["blender", "-b", "-P", "gen/obj.py", "--", tmp.name, out],
+def stage(name, done=1.0):
+    stages[name] = done
+
+@contextmanager
+def step(name):
+    """Times stage name (see metrics.py) and marks it done once it finishes"""
+    with metrics.span(name): yield
+    stage(name)
+
+def export(dir, **grids):
+    """Writes grids as raw .npy files into dir, for obj.py to memory-map"""
+    for name, grid in grids.items(): num.save(path.join(dir, f"{name}.npy"), grid)
+
+def blender(data, out, key=None):
+    """Builds scene.glb in out w/ Blender (obj.py) from the grids export wrote to data"""
+    global proc
+    proc = Popen(["blender", "-b", "-P", "gen/obj.py", "--", data, out],
         stdout=PIPE,
         stderr=DEVNULL)
 
+    stats = ""
     with Progress() as bar:
         task = bar.add_task("[yellow]Building...", total=100)
 
         for line in proc.stdout:  # type: ignore
             status = line.decode().strip()
+            if status.startswith("stats: "): stats = f" ({status[7:]})"
             with suppress(ValueError):
-                progress = float(status)
-                bar.update(task, completed=progress*100)
+                stage("geometry", float(status))
+                bar.update(task, completed=stages["geometry"]*100)
 
     ret = proc.wait()
-    if ret >= 0: print(f"[bright_yellow][{Timer()}][/]  Scene object file saved to {out}")
+    if ret >= 0: print(f"[bright_yellow][{Timer()}][/]  Scene object file saved to {out}{stats}")
     else: raise InterruptedError("Interrupted")
+    if key: cache.saveGLB(key, path.join(out, "scene.glb"))
+
+def native(kinds, heights, out, key=None):
+    timer = Timer()
+    stats = glb.write(kinds, heights, path.join(out, "scene.glb"))
+    print(f"[bright_yellow][{timer}][/]  Scene object file saved to {out} ({stats})")
+    if key: cache.saveGLB(key, path.join(out, "scene.glb"))
+
+def reseed(n):
+    """Seeds every RNG used to generate a scene (gen/, sim/rep.py)"""
+    random.seed(n); num.random.seed(n)
 
-def main(width=60, depth=80, n_nodes=None, comm_type="BLE"):
-    global W, D
+def main(width=60, depth=80, n_nodes=None, comm_type="BLE", workers=1, scene="cloud",
+         geometry="native", seed=None, backend="voxel"):
+    """
+    Builds the scene stage by stage (see STAGES, stages). Meant to run in the background:
+    rep.MESH fills in as it goes (controllers after "cloud", their links after "links").
+    """
+    global W, D, error
     W, D = width, depth
     rep.TYPE = comm_type
     timer = Timer()
-    tmp = NamedTemporaryFile(delete=False)
-    plot.rcParams["toolbar"] = "None"
-    regions = genRegions(W, D, show=False)  # generate warehouse layout
     y, r = "bright_yellow", "bright_red"
-    print(f"[{y}][{timer}][/]  Layout generated")
+    out = path.join(cwd(), "vis", "assets")
+    if not path.exists(out): mkdir(out)
 
     try:
-        kinds: Grid = features(W, D, regions, FREQ)  # place features
+        key = None
+        if seed is not None: # deterministic, so cacheable
+            reseed(seed)
+            key = cache.key(width=W, depth=D, nodes=n_nodes, comm=comm_type, seed=seed,
+                geometry=geometry, backend=backend)
+            hit = cache.load(key)
+            if hit:
+                with metrics.span("restore"):
+                    rep.restore(*hit, mode=scene)  # grids stay memory-mapped
+                    cache.loadGLB(key, path.join(out, "scene.glb"))
+                for name in STAGES: stage(name)
+                print(f"[{y}][{timer}][/]  Loaded cached scene {key}")
+                if "metrics" in config: metrics.dump(config["metrics"])
+                return
+
+        plot.rcParams["toolbar"] = "None"
+        with step("layout"): regions = genRegions(W, D, show=False)  # warehouse layout
+        print(f"[{y}][{timer}][/]  Layout generated")
+
+        with step("features"): kinds: Grid = features(W, D, regions, FREQ)  # place features
         print(f"[{y}][{timer}][/]  Features placed")
-        nodes: Grid = rep.genPoints(W, D, n=n_nodes)  # scatter nodes
+        with step("nodes"): nodes: Grid = rep.genPoints(W, D, n=n_nodes)  # scatter nodes
 
         plot.close()
-        rep.init(kinds, nodes, show=False)  # create scene rep in global rep.SCENE
+        with step("cloud"): rep.init(kinds, nodes, show=False, mode=scene)  # in rep.SCENE
         print(f"[{y}][{timer}][/]  Created internal scene representation")
-        plot.pause(0.1)
-
-        sigStren(rep.cloud, rep.MESH)
-        print(f"[{y}][{timer}][/]  Controllers found neighbors")
-
-        export(tmp, k=kinds, h=rep.heights)
-        print(f"[{y}][{timer}][/]  Saved scene data to {tmp.name}")
 
-        out = path.join(cwd(), "vis", "assets")
-        if not path.exists(out): mkdir(out)
+        with step("links"): found = backends.link(backend, rep.MESH, rep.INDEX, workers)
+        print(f"[{y}][{timer}][/]  Controllers found neighbors ({found})")
+        if key: cache.save(key, kinds, rep.heights, rep.MESH, rep.cloud)
 
-        # Start Blender process in a separate thread
-        thread = threading.Thread(target=blender, args=(tmp, out))
-        thread.start()
+        with step("geometry"):
+            if geometry == "blender":
+                with TemporaryDirectory() as tmp: # removed once Blender exits (or fails)
+                    export(tmp, kinds=kinds, heights=rep.heights)
+                    print(f"[{y}][{timer}][/]  Saved scene data to {tmp}")
+                    blender(tmp, out, key)
+            else: native(kinds, rep.heights, out, key)
+        if "metrics" in config: metrics.dump(config["metrics"])
 
     except Exception as e:
+        error = str(e)
         print(f"[{r}][{timer}]  ERROR: {e}[/]", file=stderr)
     finally:
         plot.close()
 
-    return thread
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global proc
-    kwargs = {k: config[k] for k in ["width", "depth", "nodes", "comm"] if k in config}
-    thread = main(**kwargs)
-    app.MESH = rep.MESH  # type: ignore
+    keys = ["width", "depth", "nodes", "comm", "workers", "scene", "geometry", "backend",
+        "seed"]
+    names = {"nodes": "n_nodes", "comm": "comm_type"} # key -> main() arg
+    kwargs = {names.get(k, k): config[k] for k in keys if k in config}
+    build = asyncio.create_task(asyncio.to_thread(main, **kwargs))  # serve while building
     yield
-    thread.join()
     if proc: proc.terminate()
+    await build
 
 app = FastAPI(lifespan=lifespan)
 origins = [
@@ -113,20 +173,156 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "ETag"],
 )
 
 @app.get("/progress")
 async def get_progress():
-    global progress
-    return {"progress": progress}
+    """Overall build progress [0, 1], the stage underway and each stage's progress"""
+    current = next((name for name in STAGES if stages[name] < 1), None)
+    return {"progress": sum(stages.values()) / len(STAGES), "stage": current,
+        "stages": stages, "error": error}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Build spans and tracer counters, in Prometheus' text format (see metrics.py)"""
+    return PlainTextResponse(metrics.prometheus(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def get_root():
     return {"message": "Alive"}
 
+def select(mesh, region=None, start=None, stop=None) -> List[str]:
+    """Sorted names of controllers in region (x0, y0, x1, y1; half-open), start <= name < stop"""
+    names = sorted(n for n in mesh
+        if (start is None or n >= start) and (stop is None or n < stop))
+    if region is None: return names
+    x0, y0, x1, y1 = region
+    return [n for n in names if x0 <= mesh[n].pos.x < x1 and y0 <= mesh[n].pos.y < y1]
+
+BOOT = uuid4().hex[:8]  # ETags from an earlier run never match
+SERVED = 32  # bodies kept per version (most recently used)
+# query -> body, media type, total:
+_served: OrderedDict[tuple, Tuple[bytes, str, int]] = OrderedDict()
+_servedAt = -1  # rep.VERSION _served was built at
+
+def _render(mesh, names, keys, enc) -> Tuple[bytes, str]:
+    match enc:
+        case "json":
+            body = json.dumps([mesh[n].toJson(keys) for n in names])
+            return body.encode(), "application/json"
+        case "msgpack":
+            if msgpack is None: raise HTTPException(406, "msgpack is not installed")
+            return msgpack.packb([mesh[n].toJson(keys) for n in names]), "application/msgpack"
+        case "f32":
+            pos = num.array([tuple(mesh[n].pos) for n in names], dtype="<f4").reshape(-1, 3)
+            return pos.tobytes(), "application/octet-stream"
+        case _: raise HTTPException(400, f"Invalid format: {enc}")
+
 @app.get("/controllers")
-async def controllers():
-    return [x.toJson() for x in app.MESH.values()]  # type: ignore
+async def controllers(offset: int = Query(0, ge=0), limit: int | None = Query(None, ge=0),
+                      region: str | None = None,
+                      start: str | None = None, stop: str | None = None,
+                      fields: str | None = None, enc: str = Query("json", alias="format"),
+                      if_none_match: str | None = Header(None)):
+    """
+    Pages (offset, limit) of controllers sorted by name, optionally within region "x0,y0,x1,y1"
+    and/or name range [start, stop). fields (comma separated, e.g. "name,pos") omits the rest.
+
+    format: json | ndjson (streamed, one controller per line) | msgpack | f32 (raw little-endian
+    float32 x, y, z per controller, in the order json would list them). The number of matches
+    before paging is sent as X-Total-Count.
+
+    Responses carry an ETag of rep.VERSION: unchanged meshes answer If-None-Match with 304,
+    and bodies are only serialized once per version and query.
+    """
+    global _served, _servedAt
+    etag = f'"{BOOT}-{rep.VERSION}"'
+    if etag in (if_none_match or ""): return Response(status_code=304, headers={"ETag": etag})
+    if _servedAt != rep.VERSION: _served, _servedAt = OrderedDict(), rep.VERSION
+
+    mesh = dict(list(rep.MESH.items()))  # the build thread may be adding to it
+    try: box = tuple(map(float, region.split(","))) if region else None
+    except ValueError: box = None
+    if region and (box is None or len(box) != 4):
+        raise HTTPException(400, f"Invalid region: {region}")
+    keys = fields.split(",") if fields else rep.FIELDS
+    if bad := set(keys) - set(rep.FIELDS): raise HTTPException(400, f"Invalid fields: {bad}")
+
+    query = (offset, limit, box, start, stop, tuple(keys), enc)
+    if enc != "ndjson" and query in _served:
+        body, media, total = _served[query]
+        _served.move_to_end(query)
+        return Response(body, media_type=media,
+            headers={"X-Total-Count": str(total), "ETag": etag})
+
+    names = select(mesh, box, start, stop)
+    headers = {"X-Total-Count": str(len(names)), "ETag": etag}
+    page = names[offset:None if limit is None else offset + limit]
+    if enc == "ndjson":
+        lines = (json.dumps(mesh[n].toJson(keys)) + "\n" for n in page)
+        return StreamingResponse(lines, media_type="application/x-ndjson", headers=headers)
+    body, media = _render(mesh, page, keys, enc)
+    _served[query] = body, media, len(names)
+    if len(_served) > SERVED: _served.popitem(last=False)
+    return Response(body, media_type=media, headers=headers)
+
+_snap: Tuple[int, Dict[str, tuple]] = (-1, {})  # rep.VERSION, {name: (pos, hears, c)}
+
+def snapshot() -> Dict[str, tuple]:
+    """Positions, links and instances of every controller, taken once per rep.VERSION"""
+    global _snap
+    if _snap[0] != rep.VERSION:
+        version, mesh = rep.VERSION, list(rep.MESH.items())
+        _snap = version, {n: (tuple(c.pos), dict(c.hears), c) for n, c in mesh}
+    return _snap[1]
+
+def delta(old: Dict[str, tuple], new: Dict[str, tuple]) -> Dict[str, Any]:
+    """
+    Changes from snapshot old to new: controllers added (w/o hears), moved (new pos) and
+    removed, and links [a, b, strength] changed (null once gone), each pair once (a < b)
+    """
+    links = {}
+    for name, (_, hears, _) in new.items():
+        before = old[name][1] if name in old else {}
+        for peer, stren in hears.items():
+            if before.get(peer) != stren: links[min(name, peer), max(name, peer)] = stren
+        for peer in before.keys() - hears.keys(): links[min(name, peer), max(name, peer)] = None
+    for name in old.keys() - new.keys():
+        for peer in old[name][1]: links[min(name, peer), max(name, peer)] = None
+
+    keys = [f for f in rep.FIELDS if f != "hears"]
+    return {
+        "added": [new[n][2].toJson(keys) for n in sorted(new.keys() - old.keys())],
+        "moved": {n: pos for n, (pos, _, _) in new.items() if n in old and old[n][0] != pos},
+        "removed": sorted(old.keys() - new.keys()),
+        "links": [[a, b, stren] for (a, b), stren in links.items()]
+    }
+
+@app.websocket("/ws")
+async def feed(ws: WebSocket):
+    """
+    Pushes a delta (see delta()) against what this client was last sent, at most TICK
+    times a second and only when rep.VERSION moved. Changes made while a slow client is
+    still receiving are coalesced into its next delta instead of queueing up, and the
+    simulation never waits on a client.
+    """
+    await ws.accept()
+    seen, at = {}, -1
+    recv = asyncio.create_task(ws.receive())  # only listened to for the client leaving
+    try:
+        while True:
+            if at != rep.VERSION:
+                at, now = rep.VERSION, snapshot()
+                changes = delta(seen, now)
+                if any(changes.values()): await ws.send_json({"version": at, **changes})
+                seen = now
+            done, _ = await asyncio.wait({recv}, timeout=1/TICK)
+            if done:
+                if recv.result()["type"] == "websocket.disconnect": return
+                recv = asyncio.create_task(ws.receive())
+    except WebSocketDisconnect: pass
+    finally: recv.cancel()
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -0,0 +1,96 @@
+import sys
+import numpy as num
+from os import path
+from typing import *
+from gen import box
+from . import rep, cache
+from .signal import sigStren, linkPair, STATS, MAX_STREN
+from .rep import Controller, Index, touch
+
+"""
+Pluggable propagation models that link the controllers of the current scene rep (rep.py)
+
+link("voxel", MESH, INDEX, workers=4)  # or "mesh"; fills every Controller.hears
+
+A backend is a function (mesh, index, workers) -> summary that links every pair within
+MAX_STREN of each other (index.pairs) whose strength stays above 0, both sides of hears,
+then calls touch(). Strengths share signal.py's scale: MAX_STREN - loss, loss <= MAX_STREN.
+
+- "voxel": DDA through rep.atten (signal.sigStren); loss is density x distance
+- "mesh": the C++ ray tracer (sim/signal/) over the scene's boxes (gen/box.py); loss is
+  the paths' combined dB (free space, diffraction, reflection) in excess of 1m in free
+  space, at the comm type's frequency (FREQS) and PERMITTIVITY
+
+Meshes and endpoints are traced Y-up, as in scene.glb. Endpoints sit at voxel centers;
+nodes mounted on a column's side (inside it, as voxels) are moved onto its free face.
+"""
+
+FREQS = {"BLE": 2.4e9, "WiFi": 5e9, "Radio": 868e6}  # Hz, per rep.TYPE
+PERMITTIVITY = 5.31  # concrete
+BVH = path.join(cache.DIR, "bvh")  # built BVHs, keyed by mesh (see Tracer.load)
+TRACER = path.join(path.dirname(__file__), "signal")
+
+def _tracer():
+    """sim/signal/tracer.py's Tracer; on sys.path only while it imports (flat imports)"""
+    sys.path.insert(0, TRACER)
+    try: from tracer import Tracer
+    except ImportError: return None # C++ core not built (see sim/signal/build.py)
+    finally: sys.path.remove(TRACER)
+    return Tracer
+
+Tracer = _tracer()
+
+def _geometry(kinds, heights) -> Tuple[num.ndarray, num.ndarray]:
+    """Triangulated visible faces of the boxes, Y-up"""
+    verts, faces = box.quads(box.faces(kinds, heights)[0])
+    tris = num.concatenate([faces[:, [0, 1, 2]], faces[:, [0, 2, 3]]])
+    return box.yUp(verts.astype(float)), tris
+
+def _mounts(mesh: Dict[str, Controller], heights) -> num.ndarray:
+    """(n, 3) trace endpoint of each controller (in mesh's order), Z-up"""
+    pos = num.array([tuple(c.pos) for c in mesh.values()], dtype=int).reshape(-1, 3)
+    ends = pos + 0.5
+    W, D = heights.shape
+    x, y, z = pos.T
+    inside = z < heights[x, y]
+    for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:  # first free side, as _makeNodes
+        nx, ny = x + dx, y + dy
+        ok = inside & (0 <= nx) & (nx < W) & (0 <= ny) & (ny < D)
+        ok[ok] = heights[nx[ok], ny[ok]] < z[ok]
+        ends[ok] += [dx*0.51, dy*0.51, 0]
+        inside &= ~ok
+    return ends
+
+def voxelLinks(mesh: Dict[str, Controller], index: Index, workers=1) -> str:
+    sigStren(rep.atten, mesh, index, workers=workers, cloud=rep.cloud, pyramid=rep.pyramid)
+    return str(STATS)
+
+def meshLosses(mesh: Dict[str, Controller], index: Index, workers=1):
+    """Pairs in range (by name), their losses and the number of paths traced"""
+    if Tracer is None: raise RuntimeError("Mesh tracer not built; see sim/signal/build.py")
+    pairs = list(index.pairs(MAX_STREN))
+    if not pairs: return pairs, num.empty(0), 0
+    tracer = Tracer()
+    tracer.load(*_geometry(rep.SCENE.kinds, rep.heights), cache=BVH)
+
+    rows = {name: i for i, name in enumerate(mesh)}
+    ends = box.yUp(_mounts(mesh, rep.heights))
+    rays = ends[[[rows[a], rows[b]] for a, b in pairs]].reshape(-1, 2, 3)
+    traced = tracer.traceMany(rays, threads=workers)
+    total, _, _ = Tracer.getLosses(rays, traced, FREQS[rep.TYPE], PERMITTIVITY)
+    free = 20*num.log10(FREQS[rep.TYPE]) - 147.5  # dB over 1m
+    return pairs, num.maximum(total[:, 0, 0] - free, 0), len(traced[1])
+
+def meshLinks(mesh: Dict[str, Controller], index: Index, workers=1) -> str:
+    pairs, losses, paths = meshLosses(mesh, index, workers)
+    for (a, b), loss in zip(pairs, losses.tolist()): linkPair(mesh[a], mesh[b], loss)
+    STATS.rays += len(pairs)  # one traced segment per pair
+    touch()
+    return f"{len(pairs)} pairs, {paths} paths"
+
+BACKENDS: Dict[str, Callable[..., str]] = {"voxel": voxelLinks, "mesh": meshLinks}
+
+def link(backend: str, mesh: Dict[str, Controller], index: Index, workers=1) -> str:
+    if backend not in BACKENDS:
+        raise ValueError(f"Invalid backend: {backend} (one of {', '.join(BACKENDS)})")
+    return BACKENDS[backend](mesh, index, workers)
@@ -0,0 +1,64 @@
+import click as args
+import random
+import numpy as num
+from time import perf_counter
+from typing import *
+from rich import print
+from gen.proc import genRegions
+from gen.place import features, FREQ
+from . import rep
+from .signal import MAX_STREN
+from .backend import BACKENDS
+
+"""
+Benchmarks the propagation backends (backend.py) against each other on one generated scene
+
+python -m sim.bench --width 60 --depth 80 --seed 0 --workers 4
+
+Links the same controllers with each backend in turn and reports, per backend, its time
+and throughput (candidate links, i.e. pairs in range, traced per second) and links made;
+then how well they agree: the Jaccard index of their link sets, links only one of them
+made, and the mean/max strength difference over links both made.
+"""
+
+Links = Dict[Tuple[str, str], float]
+
+def _links(mesh) -> Links:
+    return {(a, b): s for a, c in mesh.items() for b, s in c.hears.items() if a < b}
+
+def _run(backend, workers) -> Links:
+    for c in rep.MESH.values(): c.hears.clear()
+    start = perf_counter()
+    summary = BACKENDS[backend](rep.MESH, rep.INDEX, workers)
+    took = perf_counter() - start
+    links = _links(rep.MESH)
+    pairs = sum(1 for _ in rep.INDEX.pairs(MAX_STREN))
+    print(f"[bright_yellow]{backend:>6}[/]  {took:.3f}s, {pairs/took:,.0f} links/s, "
+        f"{len(links)} links ({summary})")
+    return links
+
+@args.command()
+@args.option("--width", "-w", default=60, help="Scene width")
+@args.option("--depth", "-d", default=80, help="Scene depth")
+@args.option("--nodes", "-n", type=int, default=None, help="Controllers (default: ~¼ of sites)")
+@args.option("--comm", "-c", default="BLE", help="Comm type (sets the mesh frequency)")
+@args.option("--scene", "-s", default="cloud", help="Voxel scene mode (cloud/heightfield)")
+@args.option("--workers", "-j", default=1, help="Processes (voxel) / threads (mesh)")
+@args.option("--seed", default=0, help="Scene seed")
+def bench(width, depth, nodes, comm, scene, workers, seed):
+    random.seed(seed); num.random.seed(seed)
+    rep.TYPE = comm
+    kinds = features(width, depth, genRegions(width, depth), FREQ)
+    rep.init(kinds, rep.genPoints(width, depth, n=nodes), mode=scene)
+    print(f"{len(rep.MESH)} controllers, {width}x{depth}, seed {seed}")
+
+    a, b = (_run(backend, workers) for backend in ("voxel", "mesh"))
+    both = a.keys() & b.keys()
+    union = len(a.keys() | b.keys())
+    diff = num.array([abs(a[k] - b[k]) for k in both]) if both else num.zeros(1)
+    print(f"agreement: {len(both)/union if union else 1:.1%} "
+        f"({len(a.keys() - b.keys())} voxel only, {len(b.keys() - a.keys())} mesh only); "
+        f"strength diff: mean {diff.mean():.1f}, max {diff.max():.1f}")
+
+if __name__ == "__main__":
+    bench()
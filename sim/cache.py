@@ -0,0 +1,62 @@
+import json
+import pickle
+from glob import glob
+from hashlib import sha256
+from os import path, makedirs as makeDir
+from shutil import copyfile
+from typing import *
+import numpy as num
+
+"""
+Content-addressed cache of built scenes. Entries are keyed on the generation parameters
+(incl. seed) and a hash of the generating code, so a warm start with an unchanged
+config.toml loads kinds, heights, MESH (w/ links) and scene.glb instead of rebuilding.
+Grids (and the voxel cloud) are stored as raw .npy and memory-mapped copy-on-write on
+load, so a hit reads only the pages the scene rep actually touches.
+
+k = key(width=W, depth=D, nodes=n, comm="BLE", seed=0)
+hit = load(k)  # None if any artifact is missing, else (kinds, heights, mesh, cloud)
+save(k, kinds, heights, MESH, cloud); saveGLB(k, "vis/assets/scene.glb")
+
+See main.py for usage
+"""
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+DIR = path.join(ROOT, ".cache")
+# everything that decides what a seed builds (globs; the mesh backend's links come from C++):
+SOURCES = ["main.py", "gen/proc.py", "gen/place.py", "gen/box.py", "gen/glb.py", "gen/obj.py",
+    "sim/rep.py", "sim/signal.py", "sim/backend.py", "sim/signal/pathloss.py",
+    "sim/signal/tracer.py", "sim/signal/core/*.cpp", "sim/signal/core/*.hpp"]
+
+def key(**params) -> str:
+    digest = sha256(json.dumps(params, sort_keys=True).encode())
+    for src in (f for pattern in SOURCES for f in sorted(glob(path.join(ROOT, pattern)))):
+        with open(src, "rb") as file: digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+def _entry(key, name=""):
+    return path.join(DIR, key, name)
+
+def _map(key, name):
+    file = _entry(key, f"{name}.npy")
+    return num.load(file, mmap_mode="c") if path.exists(file) else None
+
+def load(key) -> Tuple[Any, Any, Dict, Any] | None:
+    names = ["kinds.npy", "heights.npy", "mesh.pkl", "scene.glb"]
+    if not all(path.exists(_entry(key, n)) for n in names): return None
+    with open(_entry(key, "mesh.pkl"), "rb") as file: mesh = pickle.load(file)
+    return _map(key, "kinds"), _map(key, "heights"), mesh, _map(key, "cloud")
+
+def loadGLB(key, out):
+    copyfile(_entry(key, "scene.glb"), out)
+
+def save(key, kinds, heights, mesh, cloud=None):
+    makeDir(_entry(key), exist_ok=True)
+    grids = {"kinds": kinds, "heights": heights, "cloud": cloud}
+    for name, grid in grids.items():
+        if grid is not None: num.save(_entry(key, f"{name}.npy"), grid)
+    with open(_entry(key, "mesh.pkl"), "wb") as file: pickle.dump(dict(mesh), file)
+
+def saveGLB(key, out):
+    makeDir(_entry(key), exist_ok=True)
+    copyfile(out, _entry(key, "scene.glb"))
@@ -0,0 +1,96 @@
+import json
+from time import perf_counter, process_time
+from contextlib import contextmanager, suppress
+from attrs import define, asdict
+from typing import *
+from . import signal, cache
+try: from resource import getrusage, RUSAGE_SELF
+except ImportError: getrusage = None # not on Windows; peaks are then reported as 0
+
+"""
+Lightweight instrumentation of the build: timed spans and the tracer's counters
+
+with span("links"): sigStren(...)  # accumulates wall/CPU time, calls and peak RSS
+
+prometheus() renders SPANS and signal.STATS in Prometheus' text format (see /metrics in
+main.py); dump(file) writes the same as JSON, tagged with a hash of the generator
+sources (cache.key) so runs can be compared across versions.
+
+CPU time is this process' (all threads); work in child processes (the tracing pool,
+Blender) only shows in wall time. Peak RSS is measured per span on Linux (the kernel's
+high-water mark is reset as each starts; spans don't nest), elsewhere it's the process'
+max so far. Tracing workers report their own, as the span's workers peak.
+"""
+
+@define
+class Span:
+    calls: int = 0
+    wall: float = 0.0  # s
+    cpu: float = 0.0  # s
+    peak: int = 0  # max RSS while it ran, bytes
+    workers: int = 0  # max RSS of a tracing worker it started, bytes
+
+SPANS: Dict[str, Span] = {}
+
+def _reset():
+    with suppress(OSError), open("/proc/self/clear_refs", "w") as refs: refs.write("5")
+
+def _peak() -> int:
+    with suppress(OSError), open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"): return int(line.split()[1]) * 1024  # since _reset
+    return getrusage(RUSAGE_SELF).ru_maxrss * 1024 if getrusage else 0  # KiB on Linux
+
+@contextmanager
+def span(name: str):
+    _reset(); signal.PEAK = 0
+    wall, cpu = perf_counter(), process_time()
+    try: yield
+    finally:
+        stat = SPANS.setdefault(name, Span())
+        stat.calls += 1
+        stat.wall += perf_counter() - wall
+        stat.cpu += process_time() - cpu
+        stat.peak = max(stat.peak, _peak())
+        stat.workers = max(stat.workers, signal.PEAK)
+
+COUNTERS = { # signal.STATS field: metric, help
+    "rays": ("ems_rays_total", "Rays traced"),
+    "visited": ("ems_voxels_visited_total", "Voxels stepped through by the tracer"),
+    "skipped": ("ems_voxels_skipped_total", "Voxels left on rays cut short by the budget"),
+    "leaps": ("ems_bricks_leapt_total", "Empty bricks crossed in one step"),
+}
+
+def counters() -> Dict[str, int]:
+    return asdict(signal.STATS)
+
+def prometheus() -> str:
+    metrics = [ # name, type, help, {label: value}
+        ("ems_span_calls_total", "counter", "Times a build span ran",
+            {n: s.calls for n, s in SPANS.items()}),
+        ("ems_span_wall_seconds_total", "counter", "Wall time spent in a build span",
+            {n: s.wall for n, s in SPANS.items()}),
+        ("ems_span_cpu_seconds_total", "counter", "Process CPU time spent in a build span",
+            {n: s.cpu for n, s in SPANS.items()}),
+        ("ems_span_peak_rss_bytes", "gauge", "Peak resident memory during a build span",
+            {n: s.peak for n, s in SPANS.items()}),
+        ("ems_span_worker_peak_rss_bytes", "gauge",
+            "Peak resident memory of a tracing worker started in a build span",
+            {n: s.workers for n, s in SPANS.items()}),
+    ]
+    lines = []
+    for name, kind, text, values in metrics:
+        lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+        lines += [f'{name}{{span="{n}"}} {v}' for n, v in values.items()]
+    for field, value in counters().items():
+        name, text = COUNTERS[field]
+        lines += [f"# HELP {name} {text}", f"# TYPE {name} counter", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+def dump(file):
+    report = {
+        "sources": cache.key(),
+        "spans": {n: asdict(s) for n, s in SPANS.items()},
+        "counters": counters()
+    }
+    with open(file, "w") as out: json.dump(report, out, indent=2)
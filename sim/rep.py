@@ -7,6 +7,7 @@ import numpy as num
 from typing import *
 from nptyping import NDArray
 from scipy.stats import qmc
+from scipy.spatial import cKDTree as KDTree
 import matplotlib.pyplot as plot
 from matplotlib.colors import ListedColormap
 from functools import partial
@@ -16,11 +17,20 @@ Selects positions for nodes (genPoints) and builds a 3D scene representation (in
 
 SCENE is a 2D grid of "Chunks," which are 1x1xz slices of the scene. It's built from a 
 Grid[int] kinds and Grid[bool] nodes that inform the properties and content of each chunk.
+It's stored column-wise (kind codes, heights and a CSR index of node names); SCENE[x, y]
+gives a Chunk view.
 
 The intermediate heights and kinds grids are exported to Blender to build the scene glTF.
+The voxel cloud of kinds is also mapped to atten, a float32 volume of per-voxel density.
+In "heightfield" mode no cloud is built; atten is derived per voxel from heights instead.
+pyramid is atten's occupancy pyramid (makePyramid), built with it and kept current by edit,
+so tracers (signal.py) can leap over empty space without rebuilding it per trace.
 
 Chunks store the UID of any controllers therein. Actual references to a Controller
-instance is stored in dict MESH.
+instance is stored in dict MESH. INDEX is a KD-tree over MESH positions for range queries.
+VERSION counts changes to MESH (positions, links); whatever mutates it calls touch().
+After moving, adding or removing controllers in MESH, update() relinks just those and
+brings INDEX and SCENE's node index up to date.
 
 See main.py for usage
 """
@@ -80,15 +90,47 @@ class Controller:
     def genIPv6(self) -> str:
         return str(IPv6Address(choose(128))).upper()
     
-    def toJson(self):
-        return {
-            "name": self.name,
-            "comm": self.comm.toJson(),
-            "pos": asdict(self.pos),
-            "orient": asdict(self.orient),
-            "ip": self.ip,
-            "hears": self.hears
+    def toJson(self, fields: Iterable[str] | None = None):
+        """fields: subset of FIELDS to include (all by default); others aren't built"""
+        json = {
+            "name": lambda: self.name,
+            "comm": self.comm.toJson,
+            "pos": lambda: asdict(self.pos),
+            "orient": lambda: asdict(self.orient),
+            "ip": lambda: self.ip,
+            "hears": lambda: dict(self.hears)  # copied: links may be written meanwhile
         }
+        return {f: json[f]() for f in (fields or json)}
+
+FIELDS = ("name", "comm", "pos", "orient", "ip", "hears")
+
+@define
+class Index:
+    names: List[str]
+    tree: KDTree
+    rows: Dict[str, int] = field(init=False)
+
+    @rows.default # type: ignore
+    def _rows(self) -> Dict[str, int]:
+        return {name: i for i, name in enumerate(self.names)}
+
+    def pairs(self, r) -> Iterator[Tuple[str, str]]:
+        """All (A, B) pairs within r of each other, A < B"""
+        for i, j in self.tree.query_pairs(r, output_type="ndarray").tolist():
+            a, b = self.names[i], self.names[j]
+            yield (a, b) if a < b else (b, a)
+
+    def near(self, name, r) -> List[str]:
+        """Controllers within r of controller name (excluding itself)"""
+        found = self.within(self.tree.data[self.rows[name]], r)
+        return [n for n in found if n != name]
+
+    def within(self, pos, r) -> List[str]:
+        return [self.names[i] for i in self.tree.query_ball_point(tuple(pos), r)]
+
+def indexMesh(mesh: Dict[str, Controller]) -> Index:
+    pos = num.array([tuple(c.pos) for c in mesh.values()], dtype=float).reshape(-1, 3)
+    return Index(list(mesh), KDTree(pos))
 
 KINDS = {
     0: "empty",
@@ -96,9 +138,18 @@ KINDS = {
     2: "pile",
     3: "wall",
 }
+CODES = {kind: code for code, kind in KINDS.items()}
 COL = \
 [ "white", "peru", "sienna", "dimgray" ]
 
+density = {
+    "empty": 1,  # air: 100m
+    "shelf": 2,  # shelf: 50m
+    "pile": 3,  # pile: 33m
+    "wall": 5   # wall: 20m
+}
+AIR = density[KINDS[0]]
+
 @define
 class Chunk:
     kind: str
@@ -108,80 +159,200 @@ class Chunk:
 type Grid[T] = NDArray[(int, int), T] # type: ignore
 type Volume[T] = NDArray[(int, int, int), T] # type: ignore
 
+@define
+class Scene:
+    kinds: Grid[int]
+    heights: Grid[int]
+    # CSR node index: names[offsets[i]:offsets[i+1]] are in chunk i (flat, row-major)
+    offsets: NDArray
+    names: List[str]
 
-def _makeHeights(kind: int) -> int:
-    return {
-        "empty": 0,
-        "shelf": H // 2,
-        "pile": randInt(1, H // 4),
-        "wall": H
-    }[KINDS[kind]]
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.kinds.shape
 
+    def __getitem__(self, pos) -> Chunk:
+        i = num.ravel_multi_index(pos, self.shape)
+        nodes = self.names[self.offsets[i]:self.offsets[i + 1]]
+        return Chunk(KINDS[int(self.kinds[pos])], int(self.heights[pos]), nodes)
 
-def _makeCloud(kinds: Grid, heights: Grid ) -> Volume:
-    cloud = num.zeros((*kinds.shape, H), dtype=int)
+    def occupied(self) -> Grid[bool]:
+        return (num.diff(self.offsets) > 0).reshape(self.shape)
+
+
+@define
+class Heightfield:
+    """
+    Implicit atten volume: each column holds its kind's density up to its height and
+    air above. Indexes like the dense (W, D, H) volume without allocating it.
+    """
+    heights: Grid[int]
+    density: Grid[float]  # per column
+    shape: Tuple[int, int, int]
+
+    @property
+    def dtype(self):
+        return self.density.dtype
+
+    def __getitem__(self, pos):
+        x, y, z = pos
+        return num.where(z < self.heights[x, y], self.density[x, y], AIR).astype(self.dtype)
 
-    for pos in num.ndindex(kinds.shape):
-        kind = kinds[pos]
-        height = heights[pos]
-        
-        # fill w/ kind up to height:
-        cloud[*pos, :height] = kind
+@define
+class Cloud:
+    """
+    Implicit atten volume over the kinds cloud: densities are looked up per access, so
+    only the uint8 cloud is held (e.g. by tracing workers) instead of a float32 volume.
+    """
+    kinds: Volume[int]
+    density: NDArray  # per kind code, see densities()
+
+    @property
+    def shape(self):
+        return self.kinds.shape
 
-    return cloud
+    @property
+    def dtype(self):
+        return self.density.dtype
 
-def _makeChunk(kind: int, height: int) -> Chunk:
-    return Chunk(KINDS[kind], height)
+    def __getitem__(self, pos):
+        return self.density[self.kinds[pos]]
 
-def _makeNodes(chunk: Chunk, x, y, node: bool):
+
+def _makeHeights(kinds: Grid) -> Grid:
+    lut = num.array([{
+        "empty": 0,
+        "shelf": H // 2,
+        "pile": 0,  # random, below
+        "wall": H
+    }[KINDS[k]] for k in sorted(KINDS)])
+    heights = lut[kinds]
+    piles = kinds == CODES["pile"]
+    heights[piles] = num.random.randint(1, H // 4 + 1, size=piles.sum())
+    return heights
+
+
+def _makeCloud(kinds: Grid, heights: Grid ) -> Volume:
+    # fill w/ kind up to height (all columns at once):
+    filled = num.arange(H) < heights[..., None]
+    return kinds.astype(num.uint8)[..., None] * filled
+
+def densities() -> NDArray:
+    """Per-kind density, indexed by kind code"""
+    return num.array([density[KINDS[k]] for k in sorted(KINDS)], dtype=num.float32)
+
+def _makeAtten(kinds: Volume | Grid) -> Volume | Grid:
+    return densities()[kinds]
+
+BRICKS = (16, 4, 2)  # occupancy pyramid levels (brick edge, voxels); each divides the last
+
+def _pool(occupied, r) -> NDArray:
+    """Occupancy of r^3 blocks of occupied (padded w/ empty space)"""
+    n = -(-num.array(occupied.shape) // r)
+    padded = num.zeros(n*r, dtype=bool)
+    padded[tuple(slice(0, s) for s in occupied.shape)] = occupied
+    return padded.reshape(n[0], r, n[1], r, n[2], r).any(axis=(1, 3, 5))
+
+def _bricks(atten, size) -> NDArray:
+    """Occupancy of size^3 bricks of atten: whether any voxel in each isn't air"""
+    if isinstance(atten, Cloud): return _pool((atten.density != AIR)[atten.kinds], size)
+    if not isinstance(atten, Heightfield): return _pool(atten != AIR, size)
+    W, D = atten.shape[:2]
+    n = -(-num.array(atten.shape) // size)
+    tops = num.zeros((n[0]*size, n[1]*size), dtype=atten.heights.dtype)
+    tops[:W, :D] = num.where(atten.density != AIR, atten.heights, 0)
+    tops = tops.reshape(n[0], size, n[1], size).max(axis=(1, 3))  # per brick column
+    return tops[..., None] > size*num.arange(n[2])
+
+def makePyramid(atten) -> NDArray:
+    """
+    Per finest brick, the edge of the largest all-air brick containing it (1: none), so
+    one lookup tells a ray how far it may leap
+    """
+    fine = BRICKS[-1]
+    occupied = _bricks(atten, fine)
+    edges = num.where(occupied, 1, fine).astype(num.uint8)
+    for prev, edge in zip(BRICKS[::-1], BRICKS[-2::-1]):  # coarser and coarser
+        occupied = _pool(occupied, edge // prev)
+        k = edge // fine
+        free = (~occupied).repeat(k, 0).repeat(k, 1).repeat(k, 2)
+        edges[free[tuple(slice(0, s) for s in edges.shape)]] = edge
+    return edges
+
+def _columns(atten, xs: slice, ys: slice):
+    """The columns xs, ys of atten, as the same kind of volume"""
+    if isinstance(atten, Cloud): return Cloud(atten.kinds[xs, ys], atten.density)
+    if not isinstance(atten, Heightfield): return atten[xs, ys]
+    part = atten.heights[xs, ys]
+    return Heightfield(part, atten.density[xs, ys], (*part.shape, atten.shape[2]))
+
+def _regrowPyramid(mask: Grid[bool]):
+    """Rebuilds pyramid over the coarsest brick columns that hold a changed column"""
+    size, k = BRICKS[0], BRICKS[0] // BRICKS[-1]  # brick column (voxels, finest bricks)
+    for bx, by in set(map(tuple, (num.argwhere(mask) // size).tolist())):
+        part = makePyramid(_columns(atten, slice(bx*size, (bx + 1)*size),
+            slice(by*size, (by + 1)*size)))
+        pyramid[bx*k:bx*k + part.shape[0], by*k:by*k + part.shape[1]] = part
+
+def _makeScene(kinds: Grid, heights: Grid, placed: Dict[str, Tuple[int, int]]) -> Scene:
+    names = list(placed)
+    cells = num.ravel_multi_index(
+        num.array(list(placed.values()), dtype=int).reshape(-1, 2).T, kinds.shape)
+    order = num.argsort(cells, kind="stable")
+    offsets = num.zeros(kinds.size + 1, dtype=int)
+    offsets[1:] = num.cumsum(num.bincount(cells, minlength=kinds.size))
+    return Scene(kinds, heights, offsets, [names[i] for i in order])
+
+def _makeNodes(kind: str, height: int, x, y) -> str | None:
     free = None; z = 0
-    if node:
-        match chunk.kind:
-            case "empty": 
-                z = choice([0, H])
-                free = "ciel" if z == H else "floor"
-            case "shelf" | "pile" | "wall": 
-                # (0, 0) is top left (2D rep)
-                dirs = [(0, 1), (0, -1), (1, 0), (-1, 0), "top"]
-                shuffle(dirs)
-                for d in dirs:
-                    if d == "top":
-                        if chunk.height < H:
-                            z = chunk.height; free = d
-                        break
-                    pos = tuple(num.add(d, (x,y))) 
-                    W, D = _chunks.shape # bounds check (inverted):
-                    if not (0 <= pos[0] < W and 0 <= pos[1] < D): continue
-                    if chunk.height > _chunks[pos].height: #type: ignore
-                        z = randInt(_chunks[pos].height+1, chunk.height) #type: ignore
-                        free = d; break
-            case _: raise ValueError(f"Invalid feature: {chunk.kind}")
-    if free: 
-        pitch, yaw, roll = 0, 0, rand()*360
-        match free:
-            case "ciel": pitch, yaw = uniform(60, -240), uniform(60, -240)
-            case "floor": pitch, yaw = uniform(-60, 240), uniform(-60, 240)
-            case "top": pitch, yaw = uniform(0, 180), uniform(0, 180) 
-            case (1, 0): yaw = uniform(-90, 90) # E
-            case (0,-1): yaw = uniform(0, 180) # N
-            case (-1,0): yaw = uniform(90, 270) # W
-            case (0, 1): yaw = uniform(180, 360) # S
-            case _: raise ValueError(f"Invalid location: {free}")
-        if type(free) is tuple: pitch = uniform(90, 180)
-
-        name = f"C{_makeNodes.nth:0{len(str(_maxN))}d}"
-        MESH[name] = Controller(
-            name, globals()[TYPE](), Coord(x, y, z), Rot(pitch, yaw, roll),
-        ) # type: ignore
-        _makeNodes.nth += 1
-        chunk.nodes.append(name)
-
-    return chunk
+    match kind:
+        case "empty": 
+            z = choice([0, H])
+            free = "ciel" if z == H else "floor"
+        case "shelf" | "pile" | "wall": 
+            # (0, 0) is top left (2D rep)
+            dirs = [(0, 1), (0, -1), (1, 0), (-1, 0), "top"]
+            shuffle(dirs)
+            for d in dirs:
+                if d == "top":
+                    if height < H:
+                        z = height; free = d
+                    break
+                pos = (x + d[0], y + d[1])
+                W, D = heights.shape # bounds check (inverted):
+                if not (0 <= pos[0] < W and 0 <= pos[1] < D): continue
+                if height > heights[pos]:
+                    z = randInt(heights[pos]+1, height)
+                    free = d; break
+        case _: raise ValueError(f"Invalid feature: {kind}")
+    if not free: return None
+
+    pitch, yaw, roll = 0, 0, rand()*360
+    match free:
+        case "ciel": pitch, yaw = uniform(60, -240), uniform(60, -240)
+        case "floor": pitch, yaw = uniform(-60, 240), uniform(-60, 240)
+        case "top": pitch, yaw = uniform(0, 180), uniform(0, 180) 
+        case (1, 0): yaw = uniform(-90, 90) # E
+        case (0,-1): yaw = uniform(0, 180) # N
+        case (-1,0): yaw = uniform(90, 270) # W
+        case (0, 1): yaw = uniform(180, 360) # S
+        case _: raise ValueError(f"Invalid location: {free}")
+    if type(free) is tuple: pitch = uniform(90, 180)
+
+    name = f"C{_makeNodes.nth:0{len(str(_maxN))}d}"
+    MESH[name] = Controller(
+        name, globals()[TYPE](), Coord(x, y, int(z)), Rot(pitch, yaw, roll),
+    ) # type: ignore
+    _makeNodes.nth += 1
+
+    return name
 _makeNodes.nth = 0
 _maxN = 0
 
 def genPoints(x, y, r=5, n=None) -> Grid:
-    sample = qmc.PoissonDisk(d=2, radius=r / min(x, y)).fill_space()
+    # seeded from numpy's global RNG, so num.random.seed() makes sampling deterministic:
+    seed = num.random.randint(2**31)
+    sample = qmc.PoissonDisk(d=2, radius=r / min(x, y), seed=seed).fill_space()
     sample[:, 0], sample[:, 1] = sample[:, 0] * x, sample[:, 1] * y # scale: fit
     N = len(sample)
     if not n: n = N // 4
@@ -198,7 +369,7 @@ def genPoints(x, y, r=5, n=None) -> Grid:
 
 def _showFig(kinds):
     # Get updated nodes from SCENE
-    new_nodes = num.argwhere(num.vectorize(lambda x: bool(x.nodes))(SCENE))
+    new_nodes = num.argwhere(SCENE.occupied())
 
     _, ax = plot.subplots(figsize=(8, 8))
     ax.imshow(kinds, cmap=ListedColormap(COL), origin="lower")
@@ -214,16 +385,81 @@ def _showFig(kinds):
 H = 20
 TYPE: str = ""
 MESH: Dict[str, Controller] = {}
-SCENE: Grid[Chunk]; _chunks: Grid[Chunk]; heights: Grid[int]; cloud: Volume[int]
-
-def init(kinds: Grid[int], nodes: Grid[bool], show=False):
-    global SCENE, _chunks, heights, cloud
+VERSION = 0
+INDEX: Index
+SCENE: Scene; heights: Grid[int]; cloud: Volume[int] | None
+atten: Volume[float] | Heightfield; pyramid: Volume[int]
+
+def touch():
+    """Marks MESH as changed (see VERSION)"""
+    global VERSION; VERSION += 1
+
+def edit(cells, kind: int) -> NDArray:
+    """
+    Sets the chunks at cells (mask or index into the kinds grid) to kind and regrows their
+    columns in heights, atten and pyramid. Returns the flat indices (x*D + y) of changed
+    columns.
+    """
+    kinds = SCENE.kinds
+    mask = num.zeros(kinds.shape, dtype=bool); mask[cells] = True
+    mask &= kinds != kind
+    kinds[mask] = kind
+    heights[mask] = _makeHeights(kinds[mask])
+    if cloud is not None:
+        cloud[mask] = kinds[mask, None].astype(num.uint8) * \
+            (num.arange(H) < heights[mask, None])
+        atten[mask] = _makeAtten(cloud[mask])
+    else: atten.density[mask] = _makeAtten(kinds[mask])
+    _regrowPyramid(mask)
+    return num.flatnonzero(mask)
+
+def _makeVolume(kinds: Grid[int], mode: str, saved: Volume[int] | None = None):
+    global cloud, atten, pyramid
+    match mode: # atten is what the tracer in signal.py reads
+        case "cloud":
+            cloud = _makeCloud(kinds, heights) if saved is None else saved
+            atten = _makeAtten(cloud)
+        case "heightfield":
+            cloud = None
+            atten = Heightfield(heights, _makeAtten(kinds), (*kinds.shape, H))
+        case _: raise ValueError(f"Invalid scene mode: {mode}")
+    pyramid = makePyramid(atten)
+
+def init(kinds: Grid[int], nodes: Grid[bool], show=False, mode="cloud"):
+    """mode: "cloud" (dense voxel volume) or "heightfield" (implicit, from heights)"""
+    global SCENE, heights, INDEX
     # 2D primitives stored to file and passed to Blender (obj.py)
-    heights = num.vectorize(_makeHeights)(kinds)
-    _chunks = num.vectorize(_makeChunk)(kinds, heights)
-    cloud = _makeCloud(kinds, heights)
+    heights = _makeHeights(kinds)
+    _makeVolume(kinds, mode)
 
-    Xs, Ys = num.indices(_chunks.shape) # extract indices
-    SCENE = num.vectorize(_makeNodes)(_chunks, Xs, Ys, nodes)
+    placed = {} # only chunks w/ a node do any per-chunk work
+    for x, y in num.argwhere(nodes).tolist():
+        name = _makeNodes(KINDS[kinds[x, y]], heights[x, y], x, y)
+        if name: placed[name] = (x, y)
+    SCENE = _makeScene(kinds, heights, placed)
+    INDEX = indexMesh(MESH)
+    touch()
 
     if show: _showFig(kinds)
+
+def update(crossings=None):
+    """
+    Relinks controllers added, moved or removed in MESH since INDEX was built (see
+    signal.relink), then reindexes INDEX and SCENE's nodes to their current positions
+    """
+    global SCENE, INDEX
+    from .signal import relink # here: signal imports this module
+    INDEX = relink(atten, MESH, INDEX, crossings=crossings, pyramid=pyramid)
+    SCENE = _makeScene(SCENE.kinds, heights, {n: (c.pos.x, c.pos.y) for n, c in MESH.items()})
+
+def restore(kinds: Grid[int], saved: Grid[int], mesh: Dict[str, Controller],
+            voxels: Volume[int] | None = None, mode="cloud"):
+    """Rebuilds the scene rep from saved heights, controllers and cloud (see cache.py)"""
+    global SCENE, heights, INDEX, MESH
+    heights = saved
+    _makeVolume(kinds, mode, voxels)
+
+    MESH = dict(mesh)  # swapped whole; readers never see it half-filled
+    SCENE = _makeScene(kinds, heights, {n: (c.pos.x, c.pos.y) for n, c in MESH.items()})
+    INDEX = indexMesh(MESH)
+    touch()
@@ -2,13 +2,38 @@ from math import inf, dist
 from typing import *
 from numpy import sign
 from contextlib import suppress
-from .rep import KINDS
+from .rep import AIR, BRICKS, densities, makePyramid, indexMesh, Heightfield, Cloud, touch
+from attrs import define, Factory as new
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor as Pool
+from multiprocessing import get_context, get_all_start_methods
+from multiprocessing.shared_memory import SharedMemory
+import numpy as num
+try: from resource import getrusage, RUSAGE_SELF
+except ImportError: getrusage = None # not on Windows; worker peaks are then reported as 0
 
-def occlusion(start, end, cloud):
+@define
+class Stats:
+    rays: int = 0
+    visited: int = 0  # voxels stepped through
+    skipped: int = 0  # voxels left on rays cut short by the loss budget
+    leaps: int = 0  # empty bricks crossed in one step
+
+    def __str__(self):
+        return f"{self.rays} rays, {self.visited} voxels visited, {self.skipped} skipped, " \
+            f"{self.leaps} bricks leapt"
+
+    def add(self, other: "Stats"):
+        self.rays += other.rays; self.visited += other.visited; self.skipped += other.skipped
+        self.leaps += other.leaps
+
+STATS = Stats()
+
+def occlusion(start, end, atten, budget=inf):
     ray = dist(start, end)
     # ~normalize direction vector
     diff = [(e - s)/ray for s, e in zip(start, end)]
-    obstacles = []
+    loss = 0
 
     pos = [int(coord) for coord in start]
     step = sign(diff).astype(int) # step direction
@@ -22,9 +47,9 @@ def occlusion(start, end, cloud):
     t = 0  # [0, ray)
     while t < ray:
         exits = min(*inters, ray)
-        seg = exits - t; kind = 0
-        with suppress(IndexError): kind = cloud[tuple(pos)]
-        if seg > 0.01: obstacles.append((kind, seg))
+        seg = exits - t; rho = AIR
+        with suppress(IndexError): rho = atten[tuple(pos)]
+        if seg > 0.01: loss += rho*seg
 
         for i, inter in enumerate(inters):  # i = axis of exit dir
             if inter == exits:
@@ -32,26 +57,278 @@ def occlusion(start, end, cloud):
                 inters[i] += deltas[i]  # next boundary
 
         t = exits # t @ entry
+        STATS.visited += 1
+        if loss > budget and t < ray: # dead link, stop early
+            STATS.skipped += sum(abs(int(e) - p) for e, p in zip(end, pos))
+            break
+
+    STATS.rays += 1
+    return loss
+
+def occlusions(starts, ends, atten, budget=inf, track=False, pyramid=None):
+    """
+    Batched occlusion(): marches N rays through the volume in lockstep, one voxel (or empty
+    brick) per ray per step, and returns each ray's summed loss. Rays are dropped as they
+    exit, or once their loss exceeds budget (reported loss is then only a lower bound).
+
+    Empty space is skipped: a ray in an all-air brick of atten's occupancy pyramid (see
+    rep.makePyramid; built here if not given) crosses it in one step. Losses match
+    occlusion()'s but for its 0.01 sliver filter, which only applies to single voxels.
+
+    With track, also returns (rays, cols): each ray index paired with every voxel column
+    (flat x*D + y) it entered, sorted by ray. Tracked rays don't leap.
+    """
+    starts, ends = num.asarray(starts, dtype=float), num.asarray(ends, dtype=float)
+    rays = num.sqrt(((ends - starts)**2).sum(axis=1))
+    loss = num.zeros(len(rays))
+    idx = num.flatnonzero(rays > 0)  # live rays
+    hits = []
+    if not idx.size: return (loss, _crossed(hits, atten)) if track else loss
+
+    STATS.rays += len(idx)
+    if track: pyramid = None
+    elif pyramid is None: pyramid = makePyramid(atten)
+    start, ray, end = starts[idx], rays[idx], ends[idx].astype(int)
+    diff = (ends[idx] - start) / ray[:, None]
+    pos = start.astype(int)
+    step = sign(diff).astype(int)
+    t = num.zeros(len(idx))
+    bounds = num.array(atten.shape)
 
-    return obstacles
+    while idx.size:
+        inside = ((pos >= 0) & (pos < bounds)).all(axis=1)
+        edge = num.ones(len(idx), dtype=int)  # of the brick to cross (1: a voxel)
+        if pyramid is not None: edge[inside] = pyramid[tuple((pos[inside] // BRICKS[-1]).T)]
+        # first voxel boundary past the brick, per axis:
+        wall = (pos // edge[:, None] + (step > 0)) * edge[:, None]
+        with num.errstate(divide="ignore", invalid="ignore"):
+            cross = num.where(diff != 0, (wall - start) / diff, inf)
+        exits = num.maximum(num.minimum(cross.min(axis=1), ray), t)
+        seg = exits - t
+        voxel = edge == 1
+        rho = num.full(len(idx), AIR, dtype=atten.dtype)
+        rho[inside & voxel] = atten[tuple(pos[inside & voxel].T)]
+        loss[idx] += num.where((seg > 0.01) | ~voxel, rho*seg, 0)
+        if track: hits.append((idx[inside], pos[inside, 0]*bounds[1] + pos[inside, 1]))
 
-density = {
-    "empty": 1,  # air: 100m
-    "shelf": 2,  # shelf: 50m
-    "pile": 3,  # pile: 33m
-    "wall": 5   # wall: 20m
-}
+        hit = cross <= exits[:, None]  # axes of exit dir (or behind t, from rounding)
+        pos = num.where(hit, wall - (step < 0), pos)
+        if not voxel.all():  # leapt: other axes moved within the brick, never backwards
+            at = start + diff*exits[:, None]
+            moved = num.where(step < 0, num.ceil(at) - 1, num.floor(at)).astype(int)
+            moved = num.where(step < 0, num.minimum(moved, pos), num.maximum(moved, pos))
+            pos = num.where(~voxel[:, None] & ~hit, moved, pos)
+        t = exits
+        STATS.visited += int(voxel.sum()); STATS.leaps += int((~voxel).sum())
+
+        live = t < ray
+        dead = live & (loss[idx] > budget)  # dead link, stop early
+        if dead.any():
+            STATS.skipped += int(num.abs(end[dead] - pos[dead]).sum())
+            live &= ~dead
+        if not live.all():
+            idx, ray, t, pos, step = idx[live], ray[live], t[live], pos[live], step[live]
+            start, diff, end = start[live], diff[live], end[live]
+
+    return (loss, _crossed(hits, atten)) if track else loss
+
+def _crossed(hits, atten):
+    if not hits: return num.zeros(0, dtype=int), num.zeros(0, dtype=int)
+    cols = atten.shape[0]*atten.shape[1]
+    keys = num.unique(num.concatenate([r*cols + c for r, c in hits]))
+    return keys // cols, keys % cols
+
+@define
+class Crossings:
+    """
+    Reverse index of voxel columns (flat x*D + y) to the traced pairs whose rays cross
+    them, dead links included, so edits to the scene only retrace the pairs they touch.
+    """
+    cols: Dict[int, Set[Tuple[str, str]]] = new(dict)
+    paths: Dict[Tuple[str, str], List[int]] = new(dict)
+    nodes: Dict[str, Set[Tuple[str, str]]] = new(dict)
+
+    def record(self, pair, cols: List[int]):
+        self.forget(pair)
+        self.paths[pair] = cols
+        for col in cols: self.cols.setdefault(col, set()).add(pair)
+        for name in pair: self.nodes.setdefault(name, set()).add(pair)
+
+    def forget(self, pair):
+        for col in self.paths.pop(pair, ()): self.cols[col].discard(pair)
+        for name in pair:
+            if name in self.nodes: self.nodes[name].discard(pair)
+
+    def drop(self, name):
+        for pair in list(self.nodes.pop(name, ())): self.forget(pair)
+
+    def crossing(self, cols) -> Set[Tuple[str, str]]:
+        return set().union(*(self.cols.get(col, ()) for col in cols))
 
 MAX_STREN = 100
 
-def sigStren(cloud, mesh):
-    for cA in mesh.values():
-        for cB in mesh.values():
-            if cA.name >= cB.name: continue
-            if dist(cA.pos, cB.pos) > MAX_STREN: continue
-            obstacles = occlusion(cA.pos, cB.pos, cloud)
-            loss = sum(density[KINDS[o[0]]]*o[1] for o in obstacles)
-            if loss > MAX_STREN: continue
-            strength = MAX_STREN - loss
-
-            cA.hears[cB.name] = cB.hears[cA.name] = strength
+def linkPair(cA, cB, loss, budget=MAX_STREN):
+    """Links cA and cB both ways (MAX_STREN - loss), unless loss is over budget"""
+    if loss > min(budget, MAX_STREN): return
+    strength = MAX_STREN - loss
+
+    cA.hears[cB.name] = cB.hears[cA.name] = strength
+
+def _ends(pairs):
+    return num.array([(tuple(cA.pos), tuple(cB.pos)) for cA, cB in pairs], dtype=float)
+
+def _record(crossings, pairs, hits):
+    rays, cols = hits
+    bounds = num.searchsorted(rays, num.arange(len(pairs) + 1))
+    for i, (cA, cB) in enumerate(pairs):
+        crossings.record((cA.name, cB.name), cols[bounds[i]:bounds[i + 1]].tolist())
+
+def _trace(atten, pairs, budget, crossings=None, pyramid=None):
+    """Traces pairs and links those within budget, recording their paths if tracked"""
+    if pairs:
+        ends = _ends(pairs)
+        if crossings is None:
+            losses = occlusions(ends[:, 0], ends[:, 1], atten, budget, pyramid=pyramid)
+        else:
+            losses, hits = occlusions(ends[:, 0], ends[:, 1], atten, budget, track=True)
+            _record(crossings, pairs, hits)
+        for (cA, cB), loss in zip(pairs, losses.tolist()): linkPair(cA, cB, loss, budget)
+    touch()  # after links are written, so a new VERSION never serves stale links
+
+_shared: Any = None  # worker's view of the shared atten volume
+_leaps: Any = None  # and of its occupancy pyramid
+
+def _share(atten, pyramid, cloud=None) -> Tuple[List[SharedMemory], Dict[str, tuple]]:
+    """
+    Copies atten's arrays and pyramid into shared memory; specs are what workers _attach to.
+    Given the cloud atten was made from, shares that (1 byte/voxel) and the density table
+    instead of atten.
+    """
+    if isinstance(atten, Heightfield):
+        arrays = {"heights": atten.heights, "density": atten.density}
+    elif cloud is not None: arrays = {"cloud": cloud, "density": densities()}
+    else: arrays = {"atten": atten}
+    arrays["pyramid"] = pyramid
+    blocks, specs = [], {}
+    for key, array in arrays.items():
+        block = SharedMemory(create=True, size=max(1, array.nbytes))
+        num.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block); specs[key] = (block.name, array.shape, array.dtype)
+    return blocks, specs
+
+def _attach(specs, shape):
+    global _shared, _leaps
+    blocks = {key: SharedMemory(name=name) for key, (name, _, _) in specs.items()}
+    arrays = {key: num.ndarray(s, dtype=dtype, buffer=blocks[key].buf)
+        for key, (_, s, dtype) in specs.items()}
+    if "atten" in arrays: _shared = arrays["atten"]
+    elif "cloud" in arrays: _shared = Cloud(arrays["cloud"], arrays["density"])
+    else: _shared = Heightfield(arrays["heights"], arrays["density"], shape)
+    _leaps = arrays["pyramid"]
+    _attach.blocks = blocks  # keep the mappings alive for the worker's lifetime
+
+PEAK = 0  # max RSS of a tracing worker since reset (see metrics.span), bytes
+
+def _traceChunk(ends, budget, track):
+    global STATS
+    STATS = Stats()  # report this chunk's counts only
+    losses = occlusions(ends[:, 0], ends[:, 1], _shared, budget, track, _leaps)
+    return losses, STATS, getrusage(RUSAGE_SELF).ru_maxrss * 1024 if getrusage else 0
+
+def _chunk(pairs, n):
+    """Splits pairs (sorted by source) into ~n chunks without splitting a source"""
+    size = max(1, len(pairs) // n); chunk = []
+    for _, group in groupby(pairs, key=lambda p: p[0].name):
+        chunk.extend(group)
+        if len(chunk) >= size: yield chunk; chunk = []
+    if chunk: yield chunk
+
+def _context():
+    """
+    Not fork: builds run in a thread of the server, and forking a threaded process can
+    deadlock the child. The fork server imports this (and __main__) once for all workers.
+    """
+    if "forkserver" not in get_all_start_methods(): return get_context("spawn")
+    context = get_context("forkserver")
+    context.set_forkserver_preload(["__main__", __name__])
+    return context
+
+def _sigStrenPool(atten, pairs, budget, workers, crossings=None, cloud=None, pyramid=None):
+    global PEAK
+    if pyramid is None: pyramid = makePyramid(atten)
+    blocks, specs = _share(atten, pyramid, cloud)
+    try:
+        with Pool(workers, mp_context=_context(), initializer=_attach,
+                  initargs=(specs, atten.shape)) as pool:
+            chunks = list(_chunk(sorted(pairs, key=lambda p: p[0].name), workers*4))
+            track = crossings is not None
+            tasks = [pool.submit(_traceChunk, _ends(chunk), budget, track) for chunk in chunks]
+            for chunk, task in zip(chunks, tasks):
+                losses, stats, peak = task.result()
+                STATS.add(stats); PEAK = max(PEAK, peak)
+                if track:
+                    losses, hits = losses
+                    _record(crossings, chunk, hits)
+                for (cA, cB), loss in zip(chunk, losses.tolist()): linkPair(cA, cB, loss, budget)
+    finally:
+        for block in blocks: block.close(); block.unlink()
+        touch()
+
+def sigStren(atten, mesh, index=None, batch=True, budget=MAX_STREN, workers=1,
+             crossings=None, cloud=None, pyramid=None):
+    """
+    Links every pair in range whose loss stays under budget (see STATS for counts).
+    Pass atten's pyramid (rep.pyramid) to skip building one per call.
+    With workers > 1, pairs are traced in a process pool, chunked by source controller;
+    given the cloud atten was made from (rep.cloud), workers share that instead of atten.
+    Given a Crossings (batched paths only), each traced pair's columns are recorded in it.
+    """
+    if index is None: index = indexMesh(mesh)
+    pairs = [(mesh[a], mesh[b]) for a, b in index.pairs(MAX_STREN)]
+
+    if not batch:  # reference path: one ray at a time
+        for cA, cB in pairs: linkPair(cA, cB, occlusion(cA.pos, cB.pos, atten, budget), budget)
+        touch()
+    elif not pairs: return
+    elif workers > 1: _sigStrenPool(atten, pairs, budget, workers, crossings, cloud, pyramid)
+    else: _trace(atten, pairs, budget, crossings, pyramid)
+
+def relink(atten, mesh, index, budget=MAX_STREN, crossings=None, pyramid=None):
+    """
+    Recomputes links only for controllers added, moved or removed since index was built
+    (k changed controllers cost O(k·n) traces, not O(n²)), updating both sides of each
+    hears entry. Returns an index of the current mesh to pass to the next call.
+    For rep.MESH, call rep.update() instead, which also reindexes rep.INDEX and rep.SCENE.
+    """
+    old = dict(zip(index.names, map(tuple, index.tree.data.tolist())))
+    removed = old.keys() - mesh.keys()
+    changed = {name for name, c in mesh.items()
+        if old.get(name) != tuple(map(float, c.pos))}
+
+    for name in removed:  # former neighbors forget it
+        for peer in index.near(name, MAX_STREN):
+            if peer in mesh: mesh[peer].hears.pop(name, None)
+    for name in changed:  # stale links, both sides
+        for peer in mesh[name].hears:
+            if peer in mesh: mesh[peer].hears.pop(name, None)
+        mesh[name].hears.clear()
+    if crossings is not None:
+        for name in removed | changed: crossings.drop(name)
+
+    index = indexMesh(mesh)
+    pairs = {tuple(sorted((name, peer)))
+        for name in changed for peer in index.near(name, MAX_STREN)}
+    _trace(atten, [(mesh[a], mesh[b]) for a, b in sorted(pairs)], budget, crossings, pyramid)
+    return index
+
+def invalidate(atten, mesh, crossings, cols, budget=MAX_STREN) -> int:
+    """
+    Retraces only the pairs whose rays cross the changed voxel columns cols (e.g. from
+    rep.edit), updating both sides of their links. Returns the number of pairs retraced.
+    """
+    pairs = sorted(p for p in crossings.crossing(num.asarray(cols).tolist())
+        if p[0] in mesh and p[1] in mesh)
+    for a, b in pairs:
+        mesh[a].hears.pop(b, None); mesh[b].hears.pop(a, None)
+    _trace(atten, [(mesh[a], mesh[b]) for a, b in pairs], budget, crossings)
+    return len(pairs)
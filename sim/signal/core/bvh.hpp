@@ -8,6 +8,8 @@
 #include <map>
 #include <utility>
 #include <set>
+#include <cstdint>
+#include <unordered_map>
 
 #include "triangle.hpp"
 #include "ray.hpp"
@@ -49,6 +51,14 @@ public:
         max_bound_ = Vec3(max_x, max_y, max_z);
         //printf("max_bound: %.2f %.2f %.2f\n", max_x, max_y, max_z);
     }
+    // Restored box (see BVH::Unflatten): bounds as built, members only on leaves
+    Box(Vec3 min_bound, Vec3 max_bound, Triangle *leaf)
+        : min_bound_(min_bound), max_bound_(max_bound), alone_(leaf != nullptr),
+          left_(nullptr), right_(nullptr)
+    {
+        if (leaf != nullptr)
+            members_.push_back(leaf);
+    }
     ~Box()
     {
         members_.clear();
@@ -101,6 +111,7 @@ public:
         root_ = new Box(triangles);
         BVH::MakeChildren(root_, 0);
     }
+    BVH(Box *root) : root_(root) {}
     ~BVH()
     {
         delete root_;
@@ -142,6 +153,52 @@ public:
         return is_hit_once;
     }
 
+    // Flattens the tree in preorder: per box its bounds (min xyz, max xyz), children
+    // (-1 if none) and, for leaves, the index of its triangle in triangles (else -1)
+    void Flatten(std::unordered_map<Triangle *, int32_t> &triangles, std::vector<float> &bounds,
+                 std::vector<int32_t> &children, std::vector<int32_t> &leaves)
+    {
+        std::vector<std::pair<Box *, int32_t> > stack = {{root_, -1}}; // box, parent slot
+        while (!stack.empty())
+        {
+            Box *box = stack.back().first;
+            int32_t slot = stack.back().second;
+            stack.pop_back();
+            int32_t i = leaves.size();
+            if (slot >= 0)
+                children[slot] = i;
+            Vec3 &lo = box->min_bound_, &hi = box->max_bound_;
+            bounds.insert(bounds.end(), {lo.x_, lo.y_, lo.z_, hi.x_, hi.y_, hi.z_});
+            children.insert(children.end(), {-1, -1});
+            leaves.push_back(box->alone_ ? triangles[box->members_[0]] : -1);
+            if (box->right_)
+                stack.push_back({box->right_, 2 * i + 1});
+            if (box->left_)
+                stack.push_back({box->left_, 2 * i});
+        }
+    }
+
+    // Rebuilds a flattened tree (see Flatten) without re-sorting any triangles
+    static Box *Unflatten(std::vector<Triangle *> &triangles, size_t n, const float *bounds,
+                          const int32_t *children, const int32_t *leaves)
+    {
+        std::vector<Box *> boxes(n);
+        for (size_t i = 0; i < n; ++i)
+        {
+            const float *b = bounds + 6 * i;
+            boxes[i] = new Box(Vec3(b[0], b[1], b[2]), Vec3(b[3], b[4], b[5]),
+                               leaves[i] >= 0 ? triangles[leaves[i]] : nullptr);
+        }
+        for (size_t i = 0; i < n; ++i)
+        {
+            if (children[2 * i] >= 0)
+                boxes[i]->left_ = boxes[children[2 * i]];
+            if (children[2 * i + 1] >= 0)
+                boxes[i]->right_ = boxes[children[2 * i + 1]];
+        }
+        return n ? boxes[0] : nullptr;
+    }
+
     static void MakeChildren(Box *parent, int level)
     {
         //printf("depth: %d, parents members: %d \n", level, parent->members_.size());
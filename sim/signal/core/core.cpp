@@ -7,6 +7,9 @@
 #include <vector>
 #include <unordered_map>
 #include <thread>
+#include <atomic>
+#include <algorithm>
+#include <cstdint>
 
 #include "record.hpp"
 #include "vec3.hpp"
@@ -80,6 +83,107 @@ static PyObject *Trace(RayTracerObject *self, PyObject *args)
     return py_records;
 }
 
+// Flattens per-pair records into (starts, kinds, offsets, points) arrays:
+// pair i's paths are [starts[i], starts[i + 1]), path j's points [offsets[j], offsets[j + 1])
+static PyObject *RecordsToArrays(std::vector<std::vector<Record> > &results)
+{
+    npy_intp pairs_n = results.size(), paths_n = 0, points_n = 0;
+    for (std::vector<Record> &records : results)
+    {
+        paths_n += records.size();
+        for (Record &record : records)
+            points_n += record.points.size();
+    }
+
+    npy_intp starts_dims[1] = {pairs_n + 1}, kinds_dims[1] = {paths_n};
+    npy_intp offsets_dims[1] = {paths_n + 1}, points_dims[2] = {points_n, 3};
+    PyArrayObject *starts = (PyArrayObject *)PyArray_SimpleNew(1, starts_dims, NPY_INT64);
+    PyArrayObject *kinds = (PyArrayObject *)PyArray_SimpleNew(1, kinds_dims, NPY_INT32);
+    PyArrayObject *offsets = (PyArrayObject *)PyArray_SimpleNew(1, offsets_dims, NPY_INT64);
+    PyArrayObject *points = (PyArrayObject *)PyArray_SimpleNew(2, points_dims, NPY_FLOAT32);
+    if (!starts || !kinds || !offsets || !points)
+    {
+        Py_XDECREF(starts);
+        Py_XDECREF(kinds);
+        Py_XDECREF(offsets);
+        Py_XDECREF(points);
+        return NULL;
+    }
+
+    int64_t *start = (int64_t *)PyArray_DATA(starts), *offset = (int64_t *)PyArray_DATA(offsets);
+    int32_t *kind = (int32_t *)PyArray_DATA(kinds);
+    float *point = (float *)PyArray_DATA(points);
+    int64_t path = 0, vertex = 0;
+    for (npy_intp i = 0; i < pairs_n; ++i)
+    {
+        start[i] = path;
+        for (Record &record : results[i])
+        {
+            kind[path] = record.type + 1; // 1: direct, 2: diffracted, 3: reflected (as trace)
+            offset[path++] = vertex;
+            for (Vec3 &pos : record.points)
+            {
+                point[vertex * 3] = pos.x_;
+                point[vertex * 3 + 1] = pos.y_;
+                point[vertex * 3 + 2] = pos.z_;
+                ++vertex;
+            }
+        }
+    }
+    start[pairs_n] = path;
+    offset[paths_n] = vertex;
+    return Py_BuildValue("NNNN", starts, kinds, offsets, points);
+}
+
+static PyObject *TraceMany(RayTracerObject *self, PyObject *args)
+{
+    PyObject *pairsObj;
+    int max_thread = 1;
+    if (!PyArg_ParseTuple(args, "O|i", &pairsObj, &max_thread))
+        return NULL;
+
+    PyArrayObject *pairsArr = (PyArrayObject *)PyArray_FROMANY(pairsObj, NPY_FLOAT32, 3, 3,
+                                                               NPY_ARRAY_IN_ARRAY);
+    if (pairsArr == NULL)
+        return NULL;
+    if (PyArray_DIM(pairsArr, 1) != 2 || PyArray_DIM(pairsArr, 2) != 3)
+    {
+        Py_DECREF(pairsArr);
+        PyErr_SetString(PyExc_ValueError, "pairs must be an (N, 2, 3) array of (tx, rx)");
+        return NULL;
+    }
+
+    const size_t pairs_n = PyArray_DIM(pairsArr, 0);
+    const float *ends = (const float *)PyArray_DATA(pairsArr);
+    std::vector<std::vector<Record> > results(pairs_n);
+    Tracer *tracer = self->tracer;
+
+    size_t threads_n = max_thread > 0 ? max_thread : std::thread::hardware_concurrency();
+    threads_n = std::max<size_t>(1, std::min(threads_n, pairs_n));
+
+    Py_BEGIN_ALLOW_THREADS
+    // pairs vary a lot in cost (diffraction scans), so threads take them one at a time
+    std::atomic<size_t> next(0);
+    auto work = [&]()
+    {
+        for (size_t i = next++; i < pairs_n; i = next++)
+        {
+            const float *end = ends + i * 6;
+            results[i] = tracer->Trace(Vec3(end[0], end[1], end[2]), Vec3(end[3], end[4], end[5]));
+        }
+    };
+    std::vector<std::thread> threads;
+    for (size_t t = 1; t < threads_n; ++t)
+        threads.emplace_back(work);
+    work(); // this thread too
+    for (std::thread &thread : threads)
+        thread.join();
+    Py_END_ALLOW_THREADS
+
+    Py_DECREF(pairsArr);
+    return RecordsToArrays(results);
+}
+
 static PyObject *HitNearest(RayTracerObject *self, PyObject *args)
 {
     PyArrayObject *txArrObj;
@@ -204,6 +308,83 @@ static PyObject *GetTracedVolume(RayTracerObject *self, PyObject *args)
     return list_results;
 }
 
+static PyObject *GetBVH(RayTracerObject *self, PyObject *Py_UNUSED(ignored))
+{
+    Tracer *tracer = self->tracer;
+    std::unordered_map<Triangle *, int32_t> indices;
+    for (size_t i = 0; i < tracer->triangles_.size(); ++i)
+        indices[tracer->triangles_[i]] = i;
+
+    std::vector<float> bounds;
+    std::vector<int32_t> children, leaves;
+    tracer->scene_->Flatten(indices, bounds, children, leaves);
+
+    npy_intp n = leaves.size();
+    npy_intp bounds_dims[2] = {n, 6}, children_dims[2] = {n, 2}, leaves_dims[1] = {n};
+    PyArrayObject *bounds_arr = (PyArrayObject *)PyArray_SimpleNew(2, bounds_dims, NPY_FLOAT32);
+    PyArrayObject *children_arr = (PyArrayObject *)PyArray_SimpleNew(2, children_dims, NPY_INT32);
+    PyArrayObject *leaves_arr = (PyArrayObject *)PyArray_SimpleNew(1, leaves_dims, NPY_INT32);
+    if (!bounds_arr || !children_arr || !leaves_arr)
+    {
+        Py_XDECREF(bounds_arr);
+        Py_XDECREF(children_arr);
+        Py_XDECREF(leaves_arr);
+        return NULL;
+    }
+    std::copy(bounds.begin(), bounds.end(), (float *)PyArray_DATA(bounds_arr));
+    std::copy(children.begin(), children.end(), (int32_t *)PyArray_DATA(children_arr));
+    std::copy(leaves.begin(), leaves.end(), (int32_t *)PyArray_DATA(leaves_arr));
+    return Py_BuildValue("NNN", bounds_arr, children_arr, leaves_arr);
+}
+
+// Restores a BVH from the arrays GetBVH returned, or returns NULL (w/ an exception set)
+static BVH *ArraysToBVH(PyObject *bvhObj, std::vector<Triangle *> &triangles)
+{
+    PyObject *boundsObj, *childrenObj, *leavesObj;
+    if (!PyArg_ParseTuple(bvhObj, "OOO", &boundsObj, &childrenObj, &leavesObj))
+        return NULL;
+    // memory-mapped arrays of the right type are read in place
+    PyArrayObject *bounds = (PyArrayObject *)PyArray_FROMANY(boundsObj, NPY_FLOAT32, 2, 2, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children = (PyArrayObject *)PyArray_FROMANY(childrenObj, NPY_INT32, 2, 2, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *leaves = (PyArrayObject *)PyArray_FROMANY(leavesObj, NPY_INT32, 1, 1, NPY_ARRAY_IN_ARRAY);
+    BVH *bvh = NULL;
+    if (bounds && children && leaves)
+    {
+        npy_intp n = PyArray_DIM(leaves, 0);
+        const int32_t *child = (const int32_t *)PyArray_DATA(children);
+        const int32_t *leaf = (const int32_t *)PyArray_DATA(leaves);
+        bool valid = n > 0 && PyArray_DIM(bounds, 0) == n && PyArray_DIM(bounds, 1) == 6 &&
+                     PyArray_DIM(children, 0) == n && PyArray_DIM(children, 1) == 2;
+        // a tree: every box but the root has exactly one parent, so each is freed once (~Box)
+        std::vector<bool> parent_seen(valid ? n : 0, false);
+        for (npy_intp i = 0; valid && i < n; ++i) // preorder: children come after parents
+        {
+            valid = leaf[i] >= -1 && leaf[i] < (npy_intp)triangles.size() &&
+                    (leaf[i] == -1 || (child[2 * i] == -1 && child[2 * i + 1] == -1));
+            for (int side = 0; valid && side < 2; ++side)
+            {
+                int32_t c = child[2 * i + side];
+                if (c == -1)
+                    continue;
+                valid = c > i && c < n && !parent_seen[c];
+                if (valid)
+                    parent_seen[c] = true;
+            }
+        }
+        for (npy_intp i = 1; valid && i < n; ++i) // none unreachable
+            valid = parent_seen[i];
+        if (valid)
+            bvh = new BVH(BVH::Unflatten(triangles, n, (const float *)PyArray_DATA(bounds),
+                                         child, leaf));
+        else
+            PyErr_SetString(PyExc_ValueError, "BVH arrays don't match this mesh");
+    }
+    Py_XDECREF(bounds);
+    Py_XDECREF(children);
+    Py_XDECREF(leaves);
+    return bvh;
+}
+
 static PyObject *RayTracerObjectNew(PyTypeObject *type, PyObject *args, PyObject *kwds)
 {
     RayTracerObject *self;
@@ -212,8 +393,9 @@ static PyObject *RayTracerObjectNew(PyTypeObject *type, PyObject *args, PyObject
     {
         PyArrayObject *verticesArray;
         PyArrayObject *trianglesArray;
+        PyObject *bvhObj = Py_None; // optional (bounds, children, leaves), see GetBVH
 
-        if (!PyArg_ParseTuple(args, "O|O", &verticesArray, &trianglesArray))
+        if (!PyArg_ParseTuple(args, "O|OO", &verticesArray, &trianglesArray, &bvhObj))
             return NULL;
 
         size_t vert_dim_n = verticesArray->dimensions[0];
@@ -247,7 +429,20 @@ static PyObject *RayTracerObjectNew(PyTypeObject *type, PyObject *args, PyObject
             triangles.push_back(new Triangle(p1Pos, p2Pos, p3Pos));
         }
         //printf("triangles : %d\n", triangles.size());
-        self->tracer = new Tracer(triangles);
+        if (bvhObj == Py_None)
+        {
+            self->tracer = new Tracer(triangles);
+            return (PyObject *)self;
+        }
+        BVH *bvh = ArraysToBVH(bvhObj, triangles);
+        if (bvh == NULL)
+        {
+            for (Triangle *triangle : triangles)
+                delete triangle;
+            Py_DECREF(self);
+            return NULL;
+        }
+        self->tracer = new Tracer(triangles, bvh);
     }
     return (PyObject *)self;
 }
@@ -277,10 +472,12 @@ static void RayTracerObjectDealloc(RayTracerObject *self)
 /*Define methods*/
 static PyMethodDef RayTracerMethods[] = {
     {"trace", (PyCFunction)Trace, METH_VARARGS, "Trace rays from tx to rx"},
+    {"traceMany", (PyCFunction)TraceMany, METH_VARARGS, "Trace (N, 2, 3) tx/rx pairs to flat arrays"},
     {"isOutdoor", (PyCFunction)IsOutdoor, METH_VARARGS, "Check if the input position is indoor"},
     {"hitNearest", (PyCFunction)HitNearest, METH_VARARGS, "Check the nearest hit distance"},
     {"traceVolume", (PyCFunction)GetTracedVolume, METH_VARARGS, "Trace path loss volume"},
     {"getId", (PyCFunction)GetID, METH_NOARGS, "Return ID of Tracer"},
+    {"bvh", (PyCFunction)GetBVH, METH_NOARGS, "Return the BVH as (bounds, children, leaves) arrays"},
     {NULL},
 };
 
@@ -337,6 +534,7 @@ static PyModuleDef core_module = {
 PyMODINIT_FUNC
 PyInit_core(void)
 {
+    import_array();
     if (PyType_Ready(&RayTracerType) < 0)
         return NULL;
 
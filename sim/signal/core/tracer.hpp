@@ -30,6 +30,13 @@ public:
         volume_result_.clear();
     };
 
+    // With a BVH restored for these triangles (BVH::Unflatten)
+    Tracer(std::vector<Triangle *> &triangles, BVH *scene)
+        : id_(global_id++), scene_(scene), triangles_(triangles)
+    {
+        volume_result_.clear();
+    };
+
     ~Tracer()
     {
         delete scene_;
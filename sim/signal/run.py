@@ -22,7 +22,7 @@ def main():
     vertices, faces = mesh.vertices, mesh.faces # type: ignore
 
     tracer = Tracer()
-    tracer.load(vertices, faces)
+    tracer.load(vertices, faces, cache=f"{SCENE}.bvh")  # BVH kept next to the GLB
 
     a, b = [100, 60, 5], [0, 10, 20]
 
@@ -1,5 +1,10 @@
 import numpy as num
 from bin import core, calc
+from pathloss import pathLoss
+from hashlib import sha256
+from os import path, makedirs as makeDir, replace
+from tempfile import mkdtemp
+from shutil import rmtree
 
 class Tracer:
     DIM = 3
@@ -8,8 +13,34 @@ class Tracer:
         if scene:
             self.load(*read(scene))
 
-    def load(self, vertices, triangles):
+    BVH = ("bounds", "children", "leaves")  # arrays of core.Tracer.bvh()
+
+    def load(self, vertices, triangles, cache=None):
+        """
+        cache: directory to keep built BVHs in (e.g. next to the scene's GLB), keyed by a
+        hash of the mesh. A cached BVH is memory-mapped and restored instead of rebuilt.
+        """
+        vertices = num.ascontiguousarray(vertices, dtype=num.float64)
+        triangles = num.ascontiguousarray(triangles, dtype=num.uint64)
+        if not cache:
+            self.core = core.Tracer(vertices, triangles)
+            return
+
+        key = sha256(vertices.tobytes() + triangles.tobytes()).hexdigest()[:16]
+        saved = path.join(cache, key)
+        if path.exists(saved):
+            bvh = tuple(num.load(path.join(saved, f"{name}.npy"), mmap_mode="r")
+                for name in self.BVH)
+            self.core = core.Tracer(vertices, triangles, bvh)
+            return
+
         self.core = core.Tracer(vertices, triangles)
+        makeDir(cache, exist_ok=True)
+        tmp = mkdtemp(dir=cache)  # written whole, then renamed into place
+        for name, array in zip(self.BVH, self.core.bvh()):
+            num.save(path.join(tmp, f"{name}.npy"), array)
+        try: replace(tmp, saved)
+        except OSError: rmtree(tmp)  # another process saved it first
 
     def trace(self, a, b):
         if not self.core: return None
@@ -18,6 +49,27 @@ class Tracer:
         assert b.shape[0] == self.DIM and a.shape[0] == self.DIM
         return self.core.trace(a, b)
 
+    def traceMany(self, pairs, threads=1):
+        """
+        Traces N (tx, rx) pairs, an (N, 2, 3) array, in one call without holding the GIL,
+        split over threads (0: one per core). Returns flat arrays (starts, kinds, offsets,
+        points): pair i's paths are kinds[starts[i]:starts[i + 1]] (as trace: 1 direct,
+        2 diffracted, 3 reflected) and path j's points are points[offsets[j]:offsets[j + 1]].
+        """
+        if not self.core: return None
+
+        pairs = num.ascontiguousarray(pairs, dtype=num.float32)
+        assert pairs.ndim == 3 and pairs.shape[1:] == (2, self.DIM)
+        return self.core.traceMany(pairs, threads)
+
+    @staticmethod
+    def getLosses(pairs, traced, freqs=2.4e9, permittivities=5.31):
+        """
+        Batched getLoss over traceMany's output, for every freq x permittivity at once.
+        Returns (total_dB (N, F, E), loss_dB (P, F, E), delay (P,)); see pathloss.py
+        """
+        return pathLoss(pairs, traced, freqs, permittivities)
+
     @staticmethod
     def getLoss(a, b, results, freq=2.4e9, permittivity=5.31):
         if not results: return None
@@ -5,12 +5,17 @@ import "./styles.sass"
 
 interface Splash {
     progress: number
+    stage?: string
+    error?: string
 }
 
-const Splash: Component<Splash> = ({ progress }) => {
+const Splash: Component<Splash> = ({ progress, stage, error }) => {
     return (
         <div id="progress">
-            <div id="progress-label">Building... {progress.toFixed(2)}%</div>
+            <div id="progress-label">
+                {error ? `Build failed${stage ? ` (${stage})` : ""}: ${error}`
+                    : `Building${stage ? ` ${stage}` : ""}... ${progress.toFixed(2)}%`}
+            </div>
             <div id="progress-div">
                 <div id="progress-fill" style={{ width: `${progress}%` }}></div>
             </div>
@@ -25,8 +30,8 @@ export function initSplash() {
     splashRoot = ReactDOM.createRoot(parent)
 }
 
-export function updateProgress(progress: number) {
-    splashRoot.render(<Splash progress={progress} />)
+export function updateProgress(progress: number, stage?: string, error?: string) {
+    splashRoot.render(<Splash progress={progress} stage={stage} error={error} />)
 }
 
 export function removeSplash() {
@@ -1,5 +1,4 @@
 import * as THREE from "three"
-import axios from "axios"
 import { scene, COL } from "./setup"
 
 export interface Controller {
@@ -11,39 +10,84 @@ export interface Controller {
     hears: { [key: string]: number }
 }
 
+// Changes pushed over /ws; links are [a, b, strength] (null once gone)
+interface Delta {
+    version: number
+    added: Array<Omit<Controller, "hears">>
+    moved: { [key: string]: [number, number, number] }
+    removed: Array<string>
+    links: Array<[string, string, number | null]>
+}
+
 export let controllers: { [key: string]: Controller } = {}
+let changed = true // controllers changed since the last takeChanged()
 export let controllerMesh: THREE.InstancedMesh, controllerSphereMesh: THREE.InstancedMesh
 let edgeMesh: THREE.LineSegments,
     edges: Array<[string, string]> = []
 
-async function getControllers(): Promise<{ [key: string]: Controller }> {
+// Yields batches of controllers as their NDJSON lines arrive
+async function* getControllers(response: Response): AsyncGenerator<Controller[]> {
+    const reader = response.body!.pipeThrough(new TextDecoderStream()).getReader()
+    let rest = ""
+    for (;;) {
+        const { done, value } = await reader.read()
+        if (done) break
+        const lines = (rest + value).split("\n")
+        rest = lines.pop()!
+        yield lines.filter((line) => line).map((line) => JSON.parse(line))
+    }
+    if (rest) yield [JSON.parse(rest)]
+}
+
+export async function loadControllers() {
     try {
-        const response = await axios.get("http://localhost:8001/controllers")
-        return response.data.reduce((acc: { [key: string]: Controller }, item: any) => {
-            acc[item.name] = {
-                name: item.name,
-                comm: item.comm,
-                pos: item.pos,
-                orient: item.orient,
-                ip: item.ip,
-                hears: item.hears
-            }
-            return acc
-        }, {})
+        const response = await fetch("http://localhost:8001/controllers?format=ndjson"),
+            total = Number(response.headers.get("X-Total-Count"))
+        controllers = {}
+        setupControllerMesh(total)
+        setupEdgeMesh()
+        // animate() renders each batch as it arrives; capacity is known from X-Total-Count
+        for await (const batch of getControllers(response)) {
+            batch.forEach((item) => (controllers[item.name] = item))
+            changed = true
+        }
     } catch (error) {
         console.error("Error fetching data:", error)
-        return {}
     }
 }
 
-export async function loadControllers() {
-    controllers = await getControllers()
-    setupControllerMesh()
-    setupEdgeMesh()
-    updateControllers()
+export function listenControllers() {
+    const socket = new WebSocket("ws://localhost:8001/ws")
+    socket.onmessage = (event) => applyDelta(JSON.parse(event.data))
+}
+
+function applyDelta({ added, moved, removed, links }: Delta) {
+    added.forEach((item) => (controllers[item.name] = { ...item, hears: controllers[item.name]?.hears ?? {} }))
+    Object.entries(moved).forEach(([name, [x, y, z]]) => (controllers[name].pos = { x, y, z }))
+    removed.forEach((name) => delete controllers[name])
+    for (const [a, b, stren] of links) {
+        for (const [name, peer] of [[a, b], [b, a]]) {
+            if (!(name in controllers)) continue
+            if (stren === null) delete controllers[name].hears[peer]
+            else controllers[name].hears[peer] = stren
+        }
+    }
+    const count = Object.keys(controllers).length
+    if (controllerMesh && count > controllerMesh.instanceMatrix.count) {
+        scene.remove(controllerMesh, controllerSphereMesh)
+        setupControllerMesh(count * 2)
+    }
+    changed = true
 }
 
-function setupControllerMesh() {
+// Whether controllers changed since last called (so unchanged frames skip buffer rebuilds)
+export function takeChanged(): boolean {
+    const was = changed
+    changed = false
+    return was
+}
+
+function setupControllerMesh(capacity: number) {
     const pointGeometry = new THREE.SphereGeometry(0.2, 10, 10),
         sphereGeometry = new THREE.SphereGeometry(1.25, 20, 20),
         pointMaterial = new THREE.MeshBasicMaterial({ color: COL.node }),
@@ -52,22 +96,12 @@ function setupControllerMesh() {
             transparent: true,
             opacity: 0.3
         })
-    const controllerCount = Object.keys(controllers).length
-    controllerMesh = new THREE.InstancedMesh(pointGeometry, pointMaterial, controllerCount)
-    controllerSphereMesh = new THREE.InstancedMesh(sphereGeometry, sphereMaterial, controllerCount)
-
-    let index = 0
-    const tmpMatrix = new THREE.Matrix4()
-    Object.values(controllers).forEach((item: Controller) => {
-        tmpMatrix.setPosition(item.pos.x, item.pos.z, -item.pos.y)
-        controllerMesh.setMatrixAt(index, tmpMatrix)
-        controllerSphereMesh.setMatrixAt(index, tmpMatrix)
-        index++
-    })
+    controllerMesh = new THREE.InstancedMesh(pointGeometry, pointMaterial, capacity)
+    controllerSphereMesh = new THREE.InstancedMesh(sphereGeometry, sphereMaterial, capacity)
+    controllerMesh.count = controllerSphereMesh.count = 0 // grows as controllers stream in
 
     controllerMesh.position.set(-20, 0, 10)
     controllerSphereMesh.position.set(-20, 0, 10)
-    controllerMesh.instanceMatrix.needsUpdate = controllerSphereMesh.instanceMatrix.needsUpdate = true
     scene.add(controllerMesh, controllerSphereMesh)
 }
 
@@ -96,6 +130,7 @@ function updateControllerPos() {
         controllerSphereMesh.setMatrixAt(index, tmpMatrix)
         index++
     })
+    controllerMesh.count = controllerSphereMesh.count = index
     controllerMesh.instanceMatrix.needsUpdate = true
     controllerSphereMesh.instanceMatrix.needsUpdate = true
 }
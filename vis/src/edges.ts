@@ -33,6 +33,7 @@ export function updateEdges() {
             }
         }
     }
+    lineMesh.geometry.setDrawRange(0, lines * 2) // drop lines of links since removed
     position.needsUpdate = color.needsUpdate = true
 }
 
@@ -2,7 +2,7 @@ import * as THREE from "three"
 import { initCamera, initLights, initKeybinds, orientCamera } from "./setup"
 import { scene, renderer, camera, cameraControls } from "./setup"
 import { loadFactory } from "./factory"
-import { loadControllers, updateControllers } from "./controllers"
+import { loadControllers, listenControllers, updateControllers, takeChanged } from "./controllers"
 import { initSplash, updateProgress, removeSplash } from "./components/Progress"
 import { initInteract, updateInteract } from "./interact"
 import { initEdges, updateEdges } from "./edges"
@@ -12,15 +12,17 @@ const clock = new THREE.Clock()
 function animate() {
     requestAnimationFrame(animate)
     const delta = clock.getDelta()
-    updateControllers()
-    updateEdges()
+    if (takeChanged()) {
+        updateControllers()
+        updateEdges()
+    }
     updateInteract() // move popup with node
     cameraControls.update(delta)
     renderer.render(scene, camera)
 }
 
 function buildProgress(): Promise<void> {
-    return new Promise((resolve) => {
+    return new Promise((resolve, reject) => {
         initSplash()
 
         function getPerc() {
@@ -28,9 +30,10 @@ function buildProgress(): Promise<void> {
                 .then((response) => response.json())
                 .then((data) => {
                     const percentage = data.progress * 100
-                    updateProgress(percentage)
+                    updateProgress(percentage, data.stage, data.error)
 
-                    if (data.progress < 1.0) requestAnimationFrame(getPerc)
+                    if (data.error) reject(new Error(data.error)) // stays on the splash
+                    else if (data.progress < 1.0) requestAnimationFrame(getPerc)
                     else {
                         console.log("Build complete")
                         removeSplash()
@@ -50,10 +53,12 @@ export async function init() {
     await loadFactory()
     initLights()
     orientCamera({ view: "default" })
-    await loadControllers()
     initEdges()
+    const loading = loadControllers() // streamed; drawn as they arrive
     renderer.render(scene, camera)
     animate()
+    await loading
+    listenControllers() // then follow changes
 }
 
 init()